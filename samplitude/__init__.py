@@ -1,36 +1,86 @@
 #!/usr/bin/env python
 from __future__ import print_function
 
+import time
+_import_started = time.perf_counter()
+
 __version__ = '0.1.0'
 __all__ = ['samplitude']
 
-try:
-    import matplotlib.pyplot as plt
-except ImportError as err:
-    print('Warning: matplotlib unavailable, plotting disabled')
-    plt = None
-
 import itertools
-
-from ._samplitude import _Samplitude
-from ._generators import (sinegenerator, cosinegenerator, tangenerator)
-from ._utils import _generator, _set
+import math
+import os
+
+from ._samplitude import _Samplitude, _Session, ENGINES
+from ._generators import (sinegenerator, cosinegenerator, tangenerator,
+                          _Count)
+from ._utils import _ImportTimer
+from ._blocks import CHUNKSIZE, _BlockStream, _Limited, _as_count, _is_blocked
+from ._io import _NpyWriter, _csv_chunks
+from ._lines import _FileLines
+from ._combinatorics import (_Combinatoric, _Combinations, _Permutations,
+                             _Product, _is_combiner)
+from ._spectral import _Segments
+from ._stats import _HyperLogLog, _KLL, _MisraGries, _Moments
 
 s8e = _Samplitude()
 
-s8e.generator('sin', sinegenerator, infinite=True)
-s8e.generator('cos', cosinegenerator, infinite=True)
-s8e.generator('tan', tangenerator, infinite=True)
+
+def _wave(generator):
+    """The periodic `generator`, in NumPy blocks with the numpy engine."""
+    def _inner(rate, amplitude=1, phase=0):
+        session = s8e.session()
+        return generator(rate, amplitude, phase,
+                         blocked=session.engine == 'numpy',
+                         chunksize=session.chunksize)
+    return _inner
+
+
+s8e.generator('sin', _wave(sinegenerator), infinite=True)
+s8e.generator('cos', _wave(cosinegenerator), infinite=True)
+s8e.generator('tan', _wave(tangenerator), infinite=True)
 
 
 class _SizedIterator(object):
+    """The first `n` elements of `elements`, of length `n`.
+
+    Iterating is left to `itertools.islice` (or to `_Limited` for blocked
+    input), and `skip` skips ahead in `elements` itself when it can, e.g. in
+    O(1) for `count` and the periodic generators.
+
+    """
     def __init__(self, elements, n):
-        if not hasattr(elements, '__next__'):
-            self._elements = iter(elements)
-        else:
-            self._elements = elements
+        n = _as_count(n)
+        if _is_blocked(elements):
+            elements = _Limited(elements, n)
+        self._elements = elements
+        self._iter = elements if _is_blocked(elements) else None
         self._n = n
-        self._i = 0
+        self._remaining = n
+
+    @property
+    def blocked(self):
+        return _is_blocked(self._elements)
+
+    @property
+    def chunksize(self):
+        return self._elements.chunksize
+
+    def blocks(self, n=None):
+        """Yield the remaining elements as arrays, at most `n` in total
+        (blocked input only)."""
+        return self._elements.blocks(n)
+
+    def skip(self, n):
+        if self._iter is None:
+            n = min(n, self._remaining)
+            self._remaining -= n
+            self._elements = _drop(self._elements, n)
+        elif hasattr(self._iter, 'skip'):
+            self._iter.skip(n)
+        else:
+            _skip_elements(self._iter, n)
+        self._n -= min(n, self._n)
 
     def toJSON(self):
         return list(self)
@@ -39,17 +89,15 @@ class _SizedIterator(object):
         return self._n
 
     def __iter__(self):
-        return self
+        if self._iter is None:
+            self._iter = itertools.islice(self._elements, self._remaining)
+        return self._iter
 
     def __next__(self):
-        if self._i == self._n:
-            raise StopIteration
-        v = next(self._elements)
-        self._i += 1
-        return v
+        return next(iter(self))
 
 
-@s8e.generator('chi2')
+@s8e.generator('chi2', random=True)
 def _chi2(df, loc=0, scale=1):
     try:
         import scipy.stats
@@ -58,12 +106,13 @@ def _chi2(df, loc=0, scale=1):
         return
 
     chi2 = scipy.stats.chi2.rvs
+    random_state = s8e.session().numpy_random(legacy=True)
     df, loc, scale = [float(x) for x in [df, loc, scale]]
     while True:
-        yield chi2(df=df, loc=loc, scale=scale)
+        yield chi2(df=df, loc=loc, scale=scale, random_state=random_state)
 
 
-@s8e.generator('pert')
+@s8e.generator('pert', random=True)
 def _pert(low, peak, high, g=4.0):
     # From github.com/tisimst/mcerp (pypi:mcerp)
     try:
@@ -85,41 +134,35 @@ def _pert(low, peak, high, g=4.0):
     low = a
     high = c
     beta = ss.beta(a1, a2, loc=a, scale=high - low)
+    random_state = s8e.session().numpy_random(legacy=True)
     while True:
-        yield beta.rvs()
+        yield beta.rvs(random_state=random_state)
 
 
 @s8e.generator('count', infinite=True)
 def _count(start=0, step=1):
-    return itertools.count(start=start, step=step)
-
-
-def __listnstrip(gen):
-    return list(map(str.strip, gen))
+    return _Count(start=start, step=step)
 
 
 @s8e.generator('csv')
 def _csv_generator(fname, col=None, sep=None):
-    try:
-        import pandas as pd
-    except ImportError:
-        print('Warning: pandas unavailable, csv disabled')
-        return []
-    if sep is None:
-        df = pd.read_csv(fname)
-    else:
-        df = pd.read_csv(fname, sep=sep)
-    if col is None:
-        return df[df.columns[0]]
-    if isinstance(col, int):
-        return df[df.columns[col]]
-    return df[col]
+    session = s8e.session()
+    chunks = _csv_chunks(session.path(fname), col, sep,
+                         session.chunksize or CHUNKSIZE)
+    if session.engine == 'numpy':
+        first = next(chunks, [])
+        chunks = itertools.chain([first], chunks)
+        if hasattr(first, 'dtype') and first.dtype.kind in 'biuf':
+            return _BlockStream(chunks, session.chunksize)
+    return (x for chunk in chunks
+            for x in (chunk.tolist() if hasattr(chunk, 'tolist') else chunk))
 
 
 @s8e.generator('stdin')
 def _stdin_generator():
     import sys
-    return __listnstrip(sys.stdin)
+    for line in s8e.session().stdin or sys.stdin:
+        yield line.strip()
 
 
 @s8e.generator('words')
@@ -128,13 +171,11 @@ def _words_generator():
     if os.getenv('DICTIONARY') is not None:
         fname = os.getenv('DICTIONARY')
         if os.path.isfile(fname):
-            with open(fname, 'r') as fwords:
-                return __listnstrip(fwords.readlines())
+            return _FileLines(fname, strip=True)
     files = ('/usr/share/dict/words', '/usr/dict/words')
     for fname in files:
         if os.path.isfile(fname):
-            with open(fname, 'r') as fwords:
-                return __listnstrip(fwords.readlines())
+            return _FileLines(fname, strip=True)
     import sys
     sys.stderr.write('Warning: words list not found.\n'
                      'Set environment variable DICTIONARY to dict file.\n'
@@ -143,33 +184,46 @@ def _words_generator():
 
 
 @s8e.generator('file')
-def _file_generator(fname):
+def _file_generator(fname, mmap=False):
     import os
+    fname = s8e.session().path(fname)
     if not os.path.isfile(fname):
         raise IOError('No such file {}'.format(fname))
-    with open(fname, 'r') as f:
-        temp = f.read().splitlines()
-    for line in temp:
-        yield line
+    return _FileLines(fname, mmap=mmap)
 
 
 @s8e.filter('fft')
-def _fft(gen):
-    import numpy as np
-
-    try:
-        import scipy.fftpack
-    except ImportError:
-        print('Missing library scipy.fftpack, `fft` not supported')
-        return
+def _fft(gen, segment=None, window='hann', overlap=None, mode='psd'):
+    """The spectrum of `gen` as a list.
 
-    gen = np.array(gen)
-    N = len(gen)
-    f = scipy.fftpack.fft(gen)
-    return list(f[:N // 2])
+    Without `segment`, the first half of the discrete Fourier transform of
+    the entire input.  With `segment`, the input is streamed in overlapping
+    windowed segments, giving Welch's power spectral density (`mode='psd'`)
+    or the short-time Fourier transform (`mode='stft'`, a row per segment).
 
-
-@s8e.filter('dropna')
+    """
+    import numpy as np
+    if segment is None:
+        x = np.concatenate(list(_arrays(gen, None)) or [np.zeros(0)])
+        N = len(x)
+        if np.iscomplexobj(x):
+            return np.fft.fft(x)[:N // 2].tolist()
+        return np.fft.rfft(x)[:N // 2].tolist()
+    if mode not in ('psd', 'stft'):
+        raise ValueError("unknown mode %r, expected 'psd' or 'stft'" % mode)
+    spectra = _Segments(segment, window, overlap, average=mode == 'psd')
+    for block in _arrays(gen, 'float64'):
+        spectra.update(block)
+    spectrum = spectra.psd() if mode == 'psd' else spectra.stft()
+    return spectrum.tolist()
+
+
+def _dropna_blocks(blocks):
+    for block in blocks:
+        yield block[block == block]
+
+
+@s8e.filter('dropna', blocks=_dropna_blocks)
 def _dropna(gen):
     for x in gen:
         if x != x:
@@ -187,28 +241,60 @@ def _pairwise(gen):
         else:
             yield prev, elt
             prev = _sentinel
-    raise StopIteration
 
 
-@s8e.filter('round')
+def _rounder_blocks(blocks, r=3):
+    for block in blocks:
+        yield block.round(r)
+
+
+@s8e.filter('round', blocks=_rounder_blocks, elementwise='round({x}, {r})')
 def _rounder(gen, r=3):
     for x in gen:
         yield round(x, r)
 
 
-@s8e.filter('int')
+def _inter_blocks(blocks):
+    for block in blocks:
+        yield block.astype(int)
+
+
+@s8e.filter('int', blocks=_inter_blocks, elementwise='int({x})')
 def _inter(gen):
     for x in gen:
         yield int(x)
 
 
-@s8e.filter('zip')
+@s8e.filter('zip', elementwise=True)
 def _(gen1, gen2):
     for x, y in zip(gen1, gen2):
         yield x, y
 
 
-@s8e.filter('scale')
+def _aligned(blocks, other):
+    """Pairs of the blocks of `blocks` and equally long blocks of `other`,
+    a number or a blocked stream, until either is exhausted."""
+    if not _is_blocked(other):
+        for block in blocks:
+            yield block, other
+        return
+    import numpy as np
+    for block in blocks:
+        parts = list(other.blocks(len(block)))
+        other_block = np.concatenate(parts) if len(parts) != 1 else parts[0]
+        if len(other_block) < len(block):
+            if len(other_block):
+                yield block[:len(other_block)], other_block
+            return
+        yield block, other_block
+
+
+def _scale_blocks(blocks, s=1):
+    for block, s in _aligned(blocks, s):
+        yield block * s
+
+
+@s8e.filter('scale', blocks=_scale_blocks, elementwise='({x} * {s})')
 def _scale(gen, s=1):
     if isinstance(s, (int, float, complex)):
         for x in gen:
@@ -218,7 +304,12 @@ def _scale(gen, s=1):
             yield x * y
 
 
-@s8e.filter('shift')
+def _shift_blocks(blocks, s=0):
+    for block, s in _aligned(blocks, s):
+        yield block + s
+
+
+@s8e.filter('shift', blocks=_shift_blocks, elementwise='({x} + {s})')
 def _shift(gen, s=0):
     if isinstance(s, (int, float, complex)):
         for x in gen:
@@ -228,12 +319,12 @@ def _shift(gen, s=0):
             yield x + y
 
 
-@s8e.filter('sample', limiter=True)
+@s8e.filter('sample', limiter=True, prefix=True)
 def _sample(dist, n):
     return _SizedIterator(dist, n)
 
 
-@s8e.filter('head', limiter=True)
+@s8e.filter('head', limiter=True, prefix=True)
 def _head(dist, n=5):
     return _SizedIterator(dist, n)
 
@@ -254,13 +345,13 @@ def _swap(gen):
             yield elt
 
 
-@s8e.filter('elt_join')
+@s8e.filter('elt_join', elementwise=True)
 def _elt_join(gen, sep=' '):
     for x in gen:
         yield sep.join(map(str, x))
 
 
-@s8e.filter('elt_cut')
+@s8e.filter('elt_cut', elementwise=True)
 def _elt_cut(gen, fields=None, delimiter=None, s=False):
     if delimiter is None:
         delimiter = '\t'
@@ -283,23 +374,71 @@ def _gobble(*args, **kwargs):
 
 @s8e.filter('len')
 def _len(gen):
+    if isinstance(gen, _Combinatoric):
+        return gen.size
+    if hasattr(gen, 'random_access'):
+        return len(gen.random_access())
     try:
         return len(gen)
     except TypeError:
         return len(list(gen))
 
 
-@s8e.filter('drop')
+def _skip_elements(it, n):
+    """Discard the next `n` elements of the iterator `it`."""
+    next(itertools.islice(it, n, n), None)
+
+
+def _drop_elements(dist, n):
+    dist = iter(dist)
+    _skip_elements(dist, n)
+    yield from dist
+
+
 def _drop(dist, n):
-    i = 0
-    for elt in dist:
-        if i < n:
-            i += 1
-            continue
-        yield elt
+    """All but the first `n` elements, skipping them with `dist.skip(n)` if
+    available (e.g. O(1) for `count`, `sin` and blocked uniform samples)."""
+    if hasattr(dist, 'skip'):
+        dist.skip(n)
+        return dist
+    return _drop_elements(dist, n)
+
+
+s8e.filter('drop', _drop)
+
+
+def _open_unit(rng):
+    """Uniform in the open interval (0, 1)."""
+    u = rng.random()
+    while u == 0.0:
+        u = rng.random()
+    return u
+
+
+@s8e.filter('reservoir')
+def _reservoir(gen, k):
+    """A uniform random sample of `k` elements of `gen`, in one pass.
+
+    Uses Li's Algorithm L, which skips ahead between replacements, so only
+    O(k log(n/k)) random numbers are drawn for a stream of `n` elements.
+
+    """
+    rng = s8e.session().random
+    gen = iter(gen)
+    sample = list(itertools.islice(gen, k))
+    if len(sample) < k:
+        return sample
+    w = math.exp(math.log(_open_unit(rng)) / k)
+    while True:
+        skip = int(math.log(_open_unit(rng)) / math.log1p(-w))
+        for x in itertools.islice(gen, skip, skip + 1):
+            break
+        else:
+            return sample
+        sample[rng.randrange(k)] = x
+        w *= math.exp(math.log(_open_unit(rng)) / k)
 
 
-@s8e.filter('sort')
 def _sort(gen, reverse=False):
     if isinstance(gen, (int, float, complex)):
         return (gen,)
@@ -310,106 +449,247 @@ def _sort(gen, reverse=False):
     return tuple(sorted(gen, reverse=reverse))
 
 
+def _sort_first_n(gen, n, reverse=False):
+    """The first `n` elements of `gen | sort(reverse)`, by a heap."""
+    if isinstance(gen, (int, float, complex, dict)):
+        return itertools.islice(_sort(gen, reverse), n)
+    import heapq
+    return tuple((heapq.nlargest if reverse else heapq.nsmallest)(n, gen))
+
+
+s8e.filter('sort', _sort, first_n=_sort_first_n)
+
+
 @s8e.filter('counter')
 def _counter(dist):
     from collections import Counter
+    if _is_blocked(dist):
+        counter = Counter()
+        for counts in _value_counts(dist):
+            counter.update(dict(counts))
+        return counter
     return Counter(dist)
 
 
 @s8e.filter('product')
-def _product(A, B, combiner=None):
-    if combiner is None or combiner == 'tuple':
-        comb = lambda x, y: tuple((x, y))
-    elif combiner in ('add', '+'):
-        comb = lambda x, y: x + y
-    elif combiner in ('minus', 'sub', '-'):
-        comb = lambda x, y: x - y
-    elif combiner in ('mul', '*'):
-        comb = lambda x, y: x * y
-    elif combiner in ('div', '/'):
-        comb = lambda x, y: x / y
-    elif combiner in ('idiv', '//'):
-        comb = lambda x, y: x // y
-    elif combiner == 'set':
-        comb = lambda x, y: _set((x, y))
-    elif combiner.startswith('concat'):
-        comb = lambda x, y: '{}{}'.format(x, y)
-
-    return tuple(comb(a, b)
-                 for a in A for b in B)
+def _product(A, *pools, combiner=None):
+    # the combiner used to be the third positional argument
+    if combiner is None and pools and _is_combiner(pools[-1]):
+        pools, combiner = pools[:-1], pools[-1]
+    return _Product((A,) + pools, combiner)
 
 
 @s8e.filter('permutations')
 def _permutations(gen, r=None):
-    for perm in itertools.permutations(gen, r=r):
-        yield perm
+    return _Permutations(gen, r)
 
 
 @s8e.filter('combinations')
 def _combinations(gen, r):
-    for comb in itertools.combinations(gen, r=r):
-        yield comb
+    return _Combinations(gen, r)
+
+
+@s8e.filter('nth', limiter=True)
+def _nth(gen, i):
+    if isinstance(gen, _Combinatoric):
+        return gen[i]
+    if hasattr(gen, 'skip'):
+        gen.skip(i)
+        gen = iter(gen)
+    else:
+        gen = itertools.islice(gen, i, None)
+    for x in gen:
+        return x
+    raise IndexError('index out of range')
+
+
+def _pyplot():
+    try:
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print('Warning: matplotlib unavailable, plotting disabled')
+        return None
+    return plt
+
+
+def _axes(path=None):
+    """Axes to plot on and a function showing the plot, or None.
+
+    If `path` (or the session's `plot_out`) is given, the plot is drawn on a
+    new `Figure` and saved to `path` instead of shown, which needs neither a
+    display nor pyplot.
+
+    """
+    session = s8e.session()
+    if path is None:
+        path = session.plot_out
+    if path is None:
+        if session.cwd is not None:  # a client of the server, see `_server`
+            raise ValueError('the server cannot show plots, '
+                             'give --plot-out or a path to save them')
+        plt = _pyplot()
+        if plt is None:
+            return None
+        return plt.gca(), plt.show
+    try:
+        from matplotlib.figure import Figure
+    except ImportError:
+        print('Warning: matplotlib unavailable, plotting disabled')
+        return None
+    fig = Figure()
+    path = session.path(path)
+    return fig.subplots(), lambda: fig.savefig(path)
+
+
+def _reiterable(vals):
+    """The input of a plotting filter, if it can be passed on after plotting."""
+    if hasattr(vals, '__len__') and not hasattr(vals, '__next__'):
+        return vals
+    return None
 
 
 @s8e.filter('hist')
-def _hist(vals, bins=None):
-    if plt is None:
+def _hist(vals, bins=None, path=None):
+    plot = _axes(path)
+    if plot is None:
         return vals
-    vals = list(vals)  # consuming generator
-    if bins is None:
-        try:
-            plt.hist(vals, bins='auto')
-        except:
-            plt.hist(vals)
+    ax, show = plot
+    from ._binning import _Histogram
+    if bins is None or isinstance(bins, str):
+        hist = _Histogram()
+    elif isinstance(bins, int):
+        hist = _Histogram(bins)
     else:
-        plt.hist(vals, bins=bins)
-    plt.show()
-    return vals
+        hist = _Histogram(edges=bins)
+    for arr in _arrays(vals, 'float64'):
+        hist.add(arr)
+    if hist.counts is None:
+        ax.hist([])
+    else:
+        edges = hist.bin_edges()
+        ax.hist(edges[:-1], edges, weights=hist.counts)
+    show()
+    return _reiterable(vals)
 
 
 @s8e.filter('line')
-def _line(vals):
-    if plt is None:
+def _line(vals, points=2000, path=None):
+    plot = _axes(path)
+    if plot is None:
         return vals
-    vals = list(vals)  # consuming generator
-    plt.plot(vals)
-    plt.show()
-    return vals
+    ax, show = plot
+    import numpy as np
+    from ._binning import _Decimator
+    line = _Decimator(points)
+    for arr in _arrays(vals, None):
+        line.add(np.real(arr))
+    ax.plot(*line.line())
+    show()
+    return _reiterable(vals)
 
 
-@s8e.filter('scatter')
-def _scatter(vals):
-    if plt is None:
-        return vals
+def _rows(vals):
+    """Iterate over the pairs of `vals` as two-column NumPy arrays."""
+    import numpy as np
     if isinstance(vals, dict):
         vals = vals.items()
-    x, y = zip(*list(vals))
-    plt.scatter(x, y)
-    plt.show()
-    return vals
+    for chunk in _chunked(vals, n=2**16):
+        yield np.asarray(chunk, dtype=float).reshape(-1, 2)
+
+
+@s8e.filter('scatter')
+def _scatter(vals, points=10000, path=None):
+    plot = _axes(path)
+    if plot is None:
+        return vals
+    ax, show = plot
+    from ._binning import _Reservoir
+    sample = _Reservoir(points, s8e.session().numpy_random())
+    for rows in _rows(vals):
+        sample.add(rows)
+    rows = sample.rows()
+    ax.scatter(rows[:, 0], rows[:, 1])
+    show()
+    return _reiterable(vals)
 
 
 @s8e.filter('heat')
-def _(vals, res=256, color='viridis'):
-    import numpy as np
-    if plt is None:
+def _(vals, res=256, color='viridis', path=None):
+    plot = _axes(path)
+    if plot is None:
         return vals
-    if isinstance(vals, dict):
-        vals = vals.items()
-    x, y = zip(*list(vals))
-    heatmap, _, _ = np.histogram2d(x, y, bins=res)
-    plt.imshow(heatmap, cmap=color)
-    plt.show()
-    return vals
+    ax, show = plot
+    from ._binning import _Histogram
+    heatmap = _Histogram(res, dims=2)
+    for rows in _rows(vals):
+        heatmap.add(rows)
+    if heatmap.counts is not None:
+        ax.imshow(heatmap.counts, cmap=color)
+    show()
+    return _reiterable(vals)
+
+
+class _Output(object):
+    """Output of a consumer, formatted lazily.
+
+    `chunks` is a function returning an iterator over pieces of text that are
+    joined by `sep`.  `str` gives the entire output, whereas `write` writes
+    it to a file handle in buffered chunks, keeping memory use constant.
+
+    """
+    bufsize = 2**16
+
+    def __init__(self, chunks, sep='\n'):
+        self._chunks = chunks
+        self._sep = sep
+
+    def __str__(self):
+        return self._sep.join(self._chunks())
+
+    def write(self, out):
+        buf, size, written = [], 0, False
+        for chunk in self._chunks():
+            buf.append(chunk)
+            size += len(chunk)
+            if size >= self.bufsize:
+                out.write(('%s' if not written else self._sep + '%s') %
+                          self._sep.join(buf))
+                out.flush()
+                buf, size, written = [], 0, True
+        if buf:
+            out.write(('%s' if not written else self._sep + '%s') %
+                      self._sep.join(buf))
+            written = True
+        if written:
+            out.write('\n')
+        out.flush()
+
+
+def _chunked(vals, n=4096):
+    """Iterate over lists of elements of `vals`, using blocks if possible."""
+    if _is_blocked(vals):
+        for block in vals.blocks():
+            if len(block):
+                yield block.tolist()
+        return
+    vals = iter(vals)
+    while True:
+        chunk = list(itertools.islice(vals, n))
+        if not chunk:
+            return
+        yield chunk
 
 
 @s8e.filter('cli')
 def _cli(vals):
-    if isinstance(vals, dict):
-        return '\n'.join(['{} {}'.format(k, vals[k]) for k in vals])
+    if vals is None:
+        vals = ()
+    elif isinstance(vals, dict):
+        return _Output(lambda: ('{} {}'.format(k, vals[k]) for k in vals))
     elif isinstance(vals, (int, float, complex)):
         vals = [vals]
-    return '\n'.join(map(str, vals))
+    return _Output(lambda: ('\n'.join(map(str, chunk))
+                            for chunk in _chunked(vals)))
 
 
 @s8e.filter('json')
@@ -417,16 +697,157 @@ def _json(vals):
     import json
     finite = lambda x : hasattr(vals, 'finite') or not hasattr(vals, 'is_infinite')
 
-    if isinstance(vals, _SizedIterator):
-        return json.dumps(vals.toJSON())
+    def _array():
+        yield '['
+        first = True
+        for chunk in _chunked(vals):
+            yield ('' if first else ', ') + json.dumps(chunk)[1:-1]
+            first = False
+        yield ']'
+
+    if (isinstance(vals, (str, bytes, dict, list, tuple))
+            or not hasattr(vals, '__iter__')):
+        return json.dumps(vals)
+
+    if finite(vals):
+        return _Output(_array, sep='')
+    else:
+        return '<infinite generator>'
+
+
+def _arrays(vals, dtype):
+    """Iterate over `vals` as NumPy arrays of type `dtype`."""
+    import numpy as np
+    if _is_blocked(vals):
+        for block in vals.blocks():
+            yield block.astype(dtype, copy=False)
+        return
+    for chunk in _chunked(vals, n=2**16):
+        yield np.asarray(chunk, dtype=dtype)
+
+
+@s8e.filter('npy')
+def _npy(vals, path, dtype='float64'):
+    with _NpyWriter(s8e.session().path(path), dtype) as f:
+        for arr in _arrays(vals, dtype):
+            f.write(arr)
+
+
+@s8e.filter('raw')
+def _raw(vals, path, dtype='float64'):
+    with open(s8e.session().path(path), 'wb') as f:
+        for arr in _arrays(vals, dtype):
+            arr.tofile(f)
+
+
+@s8e.filter('memmap')
+def _memmap(vals, path, n=None, dtype='float64'):
+    import numpy as np
+    if n is None:
+        n = len(vals)
+    arr = np.lib.format.open_memmap(s8e.session().path(path), mode='w+',
+                                    dtype=dtype, shape=(n,))
+    i = 0
+    for chunk in _arrays(vals, dtype):
+        k = min(len(chunk), n - i)
+        arr[i:i + k] = chunk[:k]
+        i += k
+        if i == n:
+            break
+    arr.flush()
+    del arr
+    if i < n:
+        raise ValueError('memmap expected %d elements, got %d' % (n, i))
+
+
+def _summarize(vals, moments=None, sketch=None):
+    """Feed `vals` to `moments` and `sketch` in one pass, block by block."""
+    if isinstance(vals, (int, float)):
+        vals = [vals]
+    if _is_blocked(vals):
+        for block in vals.blocks():
+            if moments is not None:
+                moments.update_block(block)
+            if sketch is not None:
+                sketch.update(block.tolist())
+        return
+    for chunk in _chunked(vals):
+        if moments is not None:
+            moments.update(chunk)
+        if sketch is not None:
+            sketch.update(chunk)
+
+
+@s8e.filter('stats')
+def _stats(vals, ddof=0):
+    moments = _Moments()
+    _summarize(vals, moments=moments)
+    var = moments.var(ddof)
+    return {'n': moments.n, 'mean': moments.mean if moments.n else float('nan'),
+            'var': var, 'std': var**0.5, 'min': moments.min,
+            'max': moments.max}
+
+
+@s8e.filter('mean')
+def _mean(vals):
+    moments = _Moments()
+    _summarize(vals, moments=moments)
+    return moments.mean if moments.n else float('nan')
+
+
+@s8e.filter('var')
+def _var(vals, ddof=0):
+    moments = _Moments()
+    _summarize(vals, moments=moments)
+    return moments.var(ddof)
+
+
+@s8e.filter('quantiles')
+def _quantiles(vals, *qs, k=200):
+    qs = qs or (0.25, 0.5, 0.75)
+    sketch = _KLL(k)
+    _summarize(vals, sketch=sketch)
+    return dict(zip(qs, sketch.quantiles(qs)))
 
-    if hasattr(vals, '__next__'):
-        if finite(vals):
-            return json.dumps(list(vals))
-        else:
-            return '<infinite generator>'
 
-    return json.dumps(vals)
+def _value_counts(vals):
+    """Iterate over the (element, count) pairs of chunks of `vals`."""
+    from collections import Counter
+    if _is_blocked(vals):
+        import numpy as np
+        for block in vals.blocks():
+            values, counts = np.unique(block, return_counts=True)
+            yield zip(values.tolist(), counts.tolist())
+        return
+    for chunk in _chunked(vals, n=2**16):
+        yield Counter(chunk).items()
+
+
+@s8e.filter('topk')
+def _topk(vals, k=10, capacity=None):
+    if capacity is None:
+        capacity = max(10 * k, 1000)
+    frequent = _MisraGries(capacity)
+    for counts in _value_counts(vals):
+        frequent.update(counts)
+    return dict(frequent.top(k))
+
+
+@s8e.filter('distinct')
+def _distinct(vals, p=14):
+    sketch = _HyperLogLog(p)
+    if _is_blocked(vals):
+        import numpy as np
+        for block in vals.blocks():
+            sketch.update(np.unique(block))
+    else:
+        for chunk in _chunked(vals, n=2**16):
+            try:
+                chunk = list(set(chunk))
+            except TypeError:  # unhashable elements
+                pass
+            sketch.update(chunk)
+    return sketch.estimate()
 
 
 def __verify_no_jinja_braces(tmpl):
@@ -438,93 +859,406 @@ def __verify_no_jinja_braces(tmpl):
     return tmpl
 
 
-def _check_for_infinite_generators(template):
-    ast = s8e.jenv.parse(template)
+def _check_for_infinite_generators(stages, arguments=()):
     has_infinite_generator = False
     has_limiter = False
 
-    node = ast.body[0].nodes[0]
-    #  The AST provide nodes back to front. If an infinite generator
-    #  is found before a limiter, the expression will never complete.
-    while node is not None:
-        if hasattr(node, 'name'):
-            if node.name in ast.environment.filters:
-                filter = ast.environment.filters[node.name]
-            elif node.name in ast.environment.globals:
-                filter = ast.environment.globals[node.name]
+    #  The stages are given back to front. If an infinite generator is found
+    #  before a limiter, the expression will never complete.
+    for stage in stages:
+        if getattr(stage, 'is_infinite', False):
+            has_infinite_generator = True
+        if getattr(stage, 'is_limiter', False):
+            if has_infinite_generator:
+                break
             else:
-                raise ValueError("no filter named '%s'" % node.name)
-
-            if hasattr(filter, 'is_infinite') and filter.is_infinite:
-                has_infinite_generator = True
-            if hasattr(filter, 'is_limiter') and filter.is_limiter:
-                if has_infinite_generator:
-                    break
-                else:
-                    has_limiter = True
-
-        node = node.node if hasattr(node, 'node') else None
+                has_limiter = True
 
     if has_infinite_generator and not has_limiter:
         raise ValueError('the expression has an infinite generator')
 
+    #  An unbounded stream may only be an argument of a filter consuming it
+    #  in step with its input, e.g. `zip(count())`, and only if it is lazy.
+    for func, stages in arguments:
+        if _is_unbounded(stages) and not getattr(func, 'elementwise', None):
+            raise ValueError('an argument has an infinite generator')
+
+
+def _is_unbounded(stages):
+    """Whether the stages (back to front) of a pipe give an infinite stream,
+    raising ValueError if it would never be complete."""
+    unbounded = False
+    for stage in reversed(stages):
+        if getattr(stage, 'is_limiter', False):
+            unbounded = False
+        elif unbounded and not getattr(stage, 'elementwise', None):
+            raise ValueError('an argument has an infinite generator')
+        if getattr(stage, 'is_infinite', False):
+            unbounded = True
+    return unbounded
+
+
+def _filter_chain(expr):
+    """The filter nodes of `expr` from the source and outwards, and the source."""
+    chain = []
+    while expr.__class__.__name__ == 'Filter':
+        chain.append(expr)
+        expr = expr.node
+    return chain[::-1], expr
+
+
+def _limiter_index(chain):
+    for i, node in enumerate(chain):
+        if node.name in ('sample', 'head'):
+            return i
+    raise ValueError('parallel sampling requires sample(n) or head(n)')
+
+
+def _position_independent(chain):
+    """Whether every element of the filters `chain` only depends on the
+    element in (and random draws), so that the workers can each draw a share.
+
+    Not so for e.g. `shift(count())`, which every worker would start over.
+
+    """
+    from jinja2 import nodes
+    from jinja2.nodes import EvalContext
+    ctx = EvalContext(s8e.jenv)
+    for node in chain:
+        func = s8e.jenv.filters.get(node.name)
+        if not (getattr(func, 'elementwise', None) or
+                getattr(func, 'is_random', False)):
+            return False
+        if node.dyn_args is not None or node.dyn_kwargs is not None:
+            return False
+        try:
+            for arg in node.args + [kw.value for kw in node.kwargs]:
+                arg.as_const(ctx)
+        except nodes.Impossible:
+            return False
+    return True
+
+
+def _compile_node(expr):
+    from jinja2 import nodes
+    from jinja2.environment import TemplateExpression
+    result = nodes.Name('result', 'store', lineno=1)
+    body = [nodes.Assign(result, expr, lineno=1)]
+    template = s8e.jenv.from_string(nodes.Template(body, lineno=1))
+    return TemplateExpression(template, undefined_to_none=False)
+
+
+def _sample_worker(tmpl, size, seed, engine, chunksize, filters):
+    """Evaluate the part of `tmpl` up to its first limiter, with `size` samples.
 
-def samplitude(tmpl, seed=None, filters=None):
+    Runs in a worker process, returning the samples as an array (or list).
+
+    """
+    from jinja2 import nodes
+    import numpy as np
+    if filters:
+        s8e.add_filters(filters)
+    chain, _ = _filter_chain(s8e.jenv.parse(tmpl).body[0].nodes[0])
+    limiter = chain[_limiter_index(chain)]
+    limiter.args, limiter.kwargs = [nodes.Const(size, lineno=1)], []
+    with s8e.bind(_Session(seed, engine, chunksize)):
+        vals = _compile_node(limiter)()
+        if _is_blocked(vals):
+            return np.concatenate([np.zeros(0)] + list(vals.blocks()))
+        return list(vals)
+
+
+def _worker_filters(filters):
+    """The `filters` that can be pickled, to register in the workers.
+
+    Forked workers have the other filters (e.g. lambdas) registered already,
+    whereas with other start methods they raise ValueError.
+
+    """
+    import multiprocessing
+    import pickle
+    picklable, unpicklable = {}, []
+    for name, func in (filters or {}).items():
+        try:
+            pickle.dumps(func)
+            picklable[name] = func
+        except Exception:
+            unpicklable.append(name)
+    if unpicklable and multiprocessing.get_start_method() != 'fork':
+        raise ValueError('parallel sampling requires filters that can be'
+                         ' pickled, not %s' % ', '.join(unpicklable))
+    return picklable
+
+
+def _sample_parallel(tmpl, workers, seed, engine, chunksize, filters):
+    """Evaluate `tmpl`, splitting its first `sample(n)` across processes.
+
+    Worker `i` draws its share of the `n` samples from a stream seeded by the
+    `i`-th child of `SeedSequence(seed)`, and the shares are concatenated in
+    order, so the result only depends on the seed and the number of workers.
+    If a filter before `sample(n)` depends on the position of the elements
+    (see `_position_independent`), `tmpl` is evaluated serially instead.
+
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    from jinja2 import nodes
+    from jinja2.nodes import EvalContext
+    import numpy as np
+
+    ast = s8e.jenv.parse(tmpl)
+    chain, source = _filter_chain(ast.body[0].nodes[0])
+    i = _limiter_index(chain)
+    limiter = chain[i]
+
+    names = [node.name for node in chain[:i]]
+    if source.__class__.__name__ == 'Call':
+        names.append(getattr(source.node, 'name', None))
+    if not any(getattr(s8e.jenv.globals.get(name), 'is_random', False) or
+               getattr(s8e.jenv.filters.get(name), 'is_random', False)
+               for name in names):
+        raise ValueError('parallel sampling requires a random generator')
+    if not _position_independent(chain[:i]):
+        return _compile_node(ast.body[0].nodes[0])()  # serially
+
+    try:
+        args = [arg.as_const(EvalContext(s8e.jenv)) for arg in limiter.args]
+        kwargs = {kw.key: kw.value.as_const(EvalContext(s8e.jenv))
+                  for kw in limiter.kwargs}
+        n = int(args[0] if args else kwargs.get('n', 5))
+    except nodes.Impossible:
+        raise ValueError('parallel sampling requires a constant sample size')
+
+    filters = _worker_filters(filters)
+    sizes = [n // workers + (k < n % workers) for k in range(workers)]
+    seeds = [int(child.generate_state(1)[0])
+             for child in np.random.SeedSequence(seed).spawn(workers)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        shares = list(pool.map(_sample_worker, [tmpl] * workers, sizes, seeds,
+                               [engine] * workers, [chunksize] * workers,
+                               [filters] * workers))
+
+    if all(isinstance(share, np.ndarray) for share in shares):
+        vals = _BlockStream(iter(shares))
+    else:
+        vals = itertools.chain.from_iterable(shares)
+    vals = _SizedIterator(vals, n)
+
+    if i + 1 == len(chain):
+        return vals
+    chain[i + 1].node = nodes.Name('_s8e_input', 'load', lineno=1)
+    return _compile_node(ast.body[0].nodes[0])(_s8e_input=vals)
+
+
+def samplitude(tmpl, seed=None, filters=None, engine=None, chunksize=None,
+               out=None, workers=None, plot_out=None, profile=False):
+    """Evaluate the samplitude expression `tmpl` and return it as a string.
+
+    If `out` is a file handle and the expression ends with a streaming
+    consumer (`cli` or `json`), the output is instead written to `out` in
+    chunks as it is produced, and None is returned.
+
+    With `workers=N`, the first `sample(n)` (or `head(n)`) of a random
+    generator is split across `N` processes with independent random streams
+    spawned from `seed`; the result is reproducible for a given seed and
+    number of workers.
+
+    With `engine='numpy'` (or environment variable SAMPLITUDE_ENGINE=numpy)
+    the built-in distributions are drawn in NumPy blocks of `chunksize`
+    (default SAMPLITUDE_CHUNKSIZE or 65536) samples, which is much faster for
+    large samples, but gives different numbers for a given seed than the
+    default `python` engine.
+
+    With `plot_out`, the plotting filters save their plot to this file (with
+    the format given by its extension) instead of showing it.
+
+    With `profile=True` (or `'json'`), a table (or JSON list) of the calls,
+    elements in and out, self time, memory (when tracing with tracemalloc)
+    and throughput of every generator and filter is written to stderr, see
+    `_profile`.
+
+    """
+    engine, chunksize = _engine_settings(engine, chunksize)
+    session = _Session(seed, engine, chunksize, plot_out)
+    return _evaluate(tmpl, session, filters, out, workers, profile)
+
+
+def _engine_settings(engine=None, chunksize=None):
+    """The engine and chunk size, by default from the environment."""
+    if engine is None:
+        engine = os.getenv('SAMPLITUDE_ENGINE', 'python')
+    if chunksize is None and os.getenv('SAMPLITUDE_CHUNKSIZE'):
+        chunksize = int(os.getenv('SAMPLITUDE_CHUNKSIZE'))
+    return engine, chunksize
+
+
+def _evaluate(tmpl, session, filters=None, out=None, workers=None,
+              profile=False, err=None):
+    """Evaluate `tmpl` in `session`, see `samplitude`; a profile is written
+    to `err` (default stderr)."""
     if tmpl.strip() == '':
         raise ValueError('Empty template')
 
     tmpl = '{{ %s }}' % __verify_no_jinja_braces(tmpl)
-
-    if seed:
-        s8e.set_seed(seed)
     if filters:
         s8e.add_filters(filters)
 
-    _check_for_infinite_generators(tmpl)
+    profiler = None
+    if profile:
+        if workers is not None and workers > 1:
+            raise ValueError('profiling is not supported with workers')
+        from ._profile import _Profiler
+        profiler = _Profiler()
+    expression = s8e.expression(tmpl, check=_check_for_infinite_generators,
+                                profiler=profiler)
+
+    with s8e.bind(session):
+        if workers is not None and workers > 1:
+            res = _sample_parallel(tmpl, workers, session.seed,
+                                   session.engine, session.chunksize, filters)
+        elif profiler is not None:
+            import sys
+            from ._profile import _unwrap
+            res = _unwrap(expression())
+            with profiler.stage('(output)'):
+                res = _render(tmpl, res, out)
+            profiler.report(err or sys.stderr, as_json=profile == 'json')
+            return res
+        else:
+            res = expression()
+        return _render(tmpl, res, out)
 
-    template = s8e.jenv.from_string(tmpl)
 
-    res = template.render()
+def _render(tmpl, res, out):
+    """The value `res` of `tmpl` as a string, or None if written to `out`."""
     if res is None:
         return
 
-    if res.startswith('<samplitude._SizedIterator'):
+    if out is not None and isinstance(res, _Output):
+        res.write(out)
+        return
+
+    if isinstance(res, _Product):
+        return str(tuple(res))  # as when `product` was computed eagerly
+    if isinstance(res, (_SizedIterator, _Combinatoric)):
         tmpl = tmpl[3:-3].split('|')
         return '"{}"'.format(' | '.join(map(str.strip, tmpl)))
-    return res
+    return str(res)
 
 
 def _exit_with_usage(argv):
     msg = """\
 {0} {1}
 
-Usage:    {0} "cmd" [seed]
+Usage:    {0} [options] "cmd" [seed]
+          {0} --serve [--socket PATH]
+          {0} bench [options] [name ...]
 Example:  {0} "normal(100, 5) | sample(1000) | cli"
           {0} "normal(100, 5) | sample(1000) | cli" 1349
           {0} "normal(100, 5) | sample(1000) | hist | gobble"
           {0} "['win', 'draw', 'loss'] | choice | sample(6) | sort | cli"
+
+See {0} --help for options.
 """.format('samplitude', __version__)
     exit(msg)
 
 
-def main():
-    from sys import argv
-    if not 1 < len(argv) < 4:
-        _exit_with_usage(argv)
-
-    template = argv[1]
-    seed = None
+def _parse_args(args):
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='samplitude',
+        description='Samplitude (s8e), statistical distributions on the'
+                    ' command line.')
+    parser.add_argument('cmd', nargs='?', help='the samplitude expression')
+    parser.add_argument('seed', nargs='?', type=int, help='random seed')
+    parser.add_argument('--engine', choices=ENGINES,
+                        help='sampling engine (default python)')
+    parser.add_argument('--chunksize', type=int,
+                        help='block size for the numpy engine')
+    parser.add_argument('--workers', type=int,
+                        help='sample in parallel with this many processes')
+    parser.add_argument('--plot-out', metavar='PATH',
+                        help='save plots to this file instead of showing them')
+    parser.add_argument('--import-time', action='store_true',
+                        help='report time spent on imports to stderr')
+    parser.add_argument('--profile', action='store_true',
+                        help='report the calls, elements and time of every'
+                             ' generator and filter to stderr')
+    parser.add_argument('--profile-json', action='store_true',
+                        help='report the profile as JSON')
+    parser.add_argument('--serve', action='store_true',
+                        help='evaluate the expressions of clients on a Unix'
+                             ' socket, keeping libraries loaded')
+    parser.add_argument('--socket', metavar='PATH',
+                        help='socket of the server (default'
+                             ' SAMPLITUDE_SOCKET), to evaluate cmd there')
+    args = parser.parse_args(args)
+    if args.cmd is None and not args.serve:
+        parser.error('the following arguments are required: cmd')
+    return args
 
-    if len(argv) == 3:
-        try:
-            seed = int(argv[2])
-        except Exception:
-            _exit_with_usage(argv)
 
-    res = samplitude(template, seed=seed)
-    if res:
-        print(res)
+def main():
+    import sys
+    argv = sys.argv
+    if len(argv) < 2:
+        _exit_with_usage(argv)
+    if argv[1] == 'bench':
+        from ._bench import main as bench
+        return bench(argv[2:])
+    args = _parse_args(argv[1:])
+    if args.serve:
+        from ._server import serve
+        return serve(args.socket)
+
+    timer = _ImportTimer()
+    if args.import_time:
+        timer.start()
+
+    status = _request(args)
+    if status is not None:
+        if args.import_time:
+            timer.stop()
+            timer.report(sys.stderr, initial=[('samplitude', _import_time)])
+        exit(status)
 
+    try:
+        res = samplitude(args.cmd, seed=args.seed, engine=args.engine,
+                         chunksize=args.chunksize, out=sys.stdout,
+                         workers=args.workers, plot_out=args.plot_out,
+                         profile='json' if args.profile_json else
+                         args.profile)
+        if res:
+            print(res)
+            sys.stdout.flush()
+    except BrokenPipeError:
+        # e.g. piped into head, silence the error when flushing at exit
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        exit(1)
+
+    if args.import_time:
+        timer.stop()
+        timer.report(sys.stderr, initial=[('samplitude', _import_time)])
+
+
+def _request(args):
+    """Evaluate the expression of `args` with the server on `--socket` (or
+    SAMPLITUDE_SOCKET), if any; return the exit status, or None if there is
+    no server listening."""
+    path = args.socket or os.getenv('SAMPLITUDE_SOCKET')
+    if not path:
+        return None
+    from ._client import request
+    engine, chunksize = _engine_settings(args.engine, args.chunksize)
+    plot_out = args.plot_out and os.path.abspath(args.plot_out)
+    return request(path, {
+        'cmd': args.cmd, 'seed': args.seed, 'engine': engine,
+        'chunksize': chunksize, 'workers': args.workers,
+        'plot_out': plot_out, 'cwd': os.getcwd(),
+        'profile': 'json' if args.profile_json else args.profile})
+
+
+_import_time = time.perf_counter() - _import_started
 
 if __name__ == '__main__':
     main()
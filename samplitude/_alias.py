@@ -0,0 +1,45 @@
+class _AliasTable(object):
+    """Walker's alias table for drawing indices with the given `weights`.
+
+    The table is built in O(n) time (Vose's method), after which every draw
+    takes O(1) time: a uniformly chosen index `i` is kept with probability
+    `prob[i]`, and otherwise replaced by `alias[i]`.
+
+    """
+    def __init__(self, weights):
+        weights = [float(w) for w in weights]
+        n = len(weights)
+        total = sum(weights)
+        if n == 0:
+            raise ValueError('cannot choose from an empty sequence')
+        if any(w < 0 or w != w for w in weights) or not 0 < total < float('inf'):
+            raise ValueError('weights must be non-negative with a positive sum')
+        prob = [w * n / total for w in weights]
+        alias = list(range(n))
+        small = [i for i, p in enumerate(prob) if p < 1]
+        large = [i for i, p in enumerate(prob) if p >= 1]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            alias[s] = l
+            prob[l] += prob[s] - 1
+            (small if prob[l] < 1 else large).append(l)
+        for i in small + large:  # only rounding errors left
+            prob[i] = 1.0
+        self.n = n
+        self.prob = prob
+        self.alias = alias
+        self._arrays = None
+
+    def draw(self, rng):
+        """One index, using the `random.Random` instance `rng`."""
+        i = rng.randrange(self.n)
+        return i if rng.random() < self.prob[i] else self.alias[i]
+
+    def draw_block(self, rng, size):
+        """An array of `size` indices, using the `numpy.random.Generator`."""
+        import numpy as np
+        if self._arrays is None:
+            self._arrays = (np.array(self.prob), np.array(self.alias))
+        prob, alias = self._arrays
+        i = rng.integers(self.n, size=size)
+        return np.where(rng.random(size) < prob[i], i, alias[i])
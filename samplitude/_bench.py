@@ -0,0 +1,199 @@
+"""Benchmarks of the generators, filters and consumers, `samplitude bench`."""
+
+import collections
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+#  (kind, name, expression), where {n} is the sample size and {tmp} a path in
+#  a temporary directory.
+CASES = [
+    ('generator', 'exponential', 'exponential(2) | sample({n})'),
+    ('generator', 'uniform', 'uniform(0, 1) | sample({n})'),
+    ('generator', 'gauss', 'gauss(0, 1) | sample({n})'),
+    ('generator', 'normal', 'normal(0, 1) | sample({n})'),
+    ('generator', 'lognormal', 'lognormal(0, 1) | sample({n})'),
+    ('generator', 'triangular', 'triangular(0, 1) | sample({n})'),
+    ('generator', 'beta', 'beta(2, 3) | sample({n})'),
+    ('generator', 'gamma', 'gamma(2, 3) | sample({n})'),
+    ('generator', 'pareto', 'pareto(2) | sample({n})'),
+    ('generator', 'vonmises', 'vonmises(0, 1) | sample({n})'),
+    ('generator', 'weibull', 'weibull(1, 2) | sample({n})'),
+    ('generator', 'poisson', 'poisson(3) | sample({n})'),
+    ('generator', 'chi2', 'chi2(3) | sample({n})'),
+    ('generator', 'pert', 'pert(1, 2, 4) | sample({n})'),
+    ('generator', 'count', 'count() | sample({n})'),
+    ('generator', 'sin', 'sin(0.1) | sample({n})'),
+    ('generator', 'cos', 'cos(0.1) | sample({n})'),
+    ('generator', 'tan', 'tan(0.1) | sample({n})'),
+    ('filter', 'choice', 'range(100) | choice | sample({n})'),
+    ('filter', 'wchoice',
+     'range(1000) | wchoice(range(1, 1001)) | sample({n})'),
+    ('filter', 'shuffle', 'range({n}) | shuffle'),
+    ('filter', 'dropna', 'uniform(0, 1) | sample({n}) | dropna'),
+    ('filter', 'round', 'uniform(0, 1) | sample({n}) | round'),
+    ('filter', 'int', 'uniform(0, 9) | sample({n}) | int'),
+    ('filter', 'scale', 'uniform(0, 1) | sample({n}) | scale(2)'),
+    ('filter', 'shift', 'uniform(0, 1) | sample({n}) | shift(2)'),
+    ('filter', 'drop', 'uniform(0, 1) | sample({n}) | drop(10)'),
+    ('filter', 'skip', 'uniform(0, 1) | drop({n}) | head(10)'),
+    ('filter', 'pairs', 'uniform(0, 1) | sample({n}) | pairs'),
+    ('filter', 'zip', 'uniform(0, 1) | sample({n}) | zip(count())'),
+    ('filter', 'swap', 'uniform(0, 1) | sample({n}) | pairs | swap'),
+    ('filter', 'elt_join', 'uniform(0, 1) | sample({n}) | pairs | elt_join'),
+    ('filter', 'elt_cut', "range(100) | choice | sample({n}) | elt_cut"),
+    ('filter', 'sort', 'uniform(0, 1) | sample({n}) | sort'),
+    ('filter', 'counter', 'range(100) | choice | sample({n}) | counter'),
+    ('filter', 'topk', 'range(100) | choice | sample({n}) | topk(5)'),
+    ('filter', 'distinct', 'uniform(0, 1) | sample({n}) | distinct'),
+    ('filter', 'fft', 'sin(0.1) | sample({n}) | fft'),
+    ('filter', 'welch', 'sin(0.1) | sample({n}) | fft(1024)'),
+    ('filter', 'product', 'range({n} // 100) | product(range(100))'),
+    ('filter', 'permutations', 'range({n}) | permutations(1)'),
+    ('filter', 'combinations', 'range({n}) | combinations(1)'),
+    ('filter', 'nth', 'range({n}) | combinations(3) | choice | sample({n})'),
+    ('consumer', 'hist',
+     "normal(0, 1) | sample({n}) | hist(path='{tmp}.png')"),
+    ('consumer', 'len', 'uniform(0, 1) | sample({n}) | list | len'),
+    ('consumer', 'stats', 'uniform(0, 1) | sample({n}) | stats'),
+    ('consumer', 'quantiles',
+     'uniform(0, 1) | sample({n}) | quantiles(0.5, 0.99)'),
+    ('consumer', 'cli', 'uniform(0, 1) | sample({n}) | cli'),
+    ('consumer', 'json', 'uniform(0, 1) | sample({n}) | json'),
+    ('consumer', 'npy', "uniform(0, 1) | sample({n}) | npy('{tmp}.npy')"),
+    ('consumer', 'raw', "uniform(0, 1) | sample({n}) | raw('{tmp}.raw')"),
+    ('consumer', 'memmap',
+     "uniform(0, 1) | sample({n}) | memmap('{tmp}.mm.npy')"),
+]
+
+
+def _drain(vals, out):
+    """Consume the result of an expression without keeping it."""
+    from . import _Output
+    from ._blocks import _is_blocked
+    if isinstance(vals, _Output):
+        vals.write(out)
+    elif _is_blocked(vals):
+        for _ in vals.blocks():
+            pass
+    elif hasattr(vals, '__iter__') and not isinstance(vals, (str, dict)):
+        collections.deque(vals, maxlen=0)
+
+
+def _run(expr, seed, engine, chunksize, out, memory=False):
+    from . import s8e, _check_for_infinite_generators
+    from ._samplitude import _Session
+    expression = s8e.expression('{{ %s }}' % expr,
+                                check=_check_for_infinite_generators)
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    with s8e.bind(_Session(seed, engine, chunksize)):
+        _drain(expression(), out)
+    seconds = time.perf_counter() - start
+    peak = 0
+    if memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return seconds, peak
+
+
+def bench(names=(), sizes=(10**4, 10**5, 10**6), engine='python',
+          chunksize=None, repeat=3, memory=True, seed=1729):
+    """Time the benchmark cases (all, or those in `names`) at `sizes`.
+
+    Returns a list of result dicts, with the best time of `repeat` runs and,
+    if `memory`, the peak traced memory of a separate run.
+
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tmp, open(os.devnull, 'w') as out:
+        for kind, name, expr in CASES:
+            if names and name not in names:
+                continue
+            for n in sizes:
+                expr_n = expr.format(n=n, tmp=os.path.join(tmp, name))
+                try:
+                    seconds = min(_run(expr_n, seed, engine, chunksize, out)[0]
+                                  for _ in range(max(repeat, 1)))
+                    peak = None
+                    if memory:
+                        peak = _run(expr_n, seed, engine, chunksize, out,
+                                    memory=True)[1]
+                except Exception as err:
+                    results.append({'kind': kind, 'name': name, 'n': n,
+                                    'engine': engine, 'expression': expr_n,
+                                    'error': '%s: %s' % (type(err).__name__,
+                                                         err)})
+                    continue
+                results.append({'kind': kind, 'name': name, 'n': n,
+                                'engine': engine, 'expression': expr_n,
+                                'seconds': seconds,
+                                'samples_per_sec': n / seconds,
+                                'peak_bytes': peak})
+    return results
+
+
+def _key(result):
+    return (result['kind'], result['name'], result['n'], result['engine'])
+
+
+def _report(results, out, baseline=None):
+    baseline = {_key(r): r for r in (baseline or []) if 'seconds' in r}
+    out.write('{:10} {:14} {:>10} {:>14} {:>12}{}\n'.format(
+        'kind', 'name', 'n', 'samples/sec', 'peak KiB',
+        '  vs baseline' if baseline else ''))
+    for r in results:
+        if 'error' in r:
+            out.write('{:10} {:14} {:>10} {}\n'.format(
+                r['kind'], r['name'], r['n'], r['error']))
+            continue
+        peak = '-' if r['peak_bytes'] is None else r['peak_bytes'] // 1024
+        line = '{:10} {:14} {:>10} {:>14.4g} {:>12}'.format(
+            r['kind'], r['name'], r['n'], r['samples_per_sec'], peak)
+        old = baseline.get(_key(r))
+        if old is not None:
+            line += '  {:>10.2f}x'.format(old['seconds'] / r['seconds'])
+        out.write(line + '\n')
+
+
+def main(argv):
+    import argparse
+    from . import __version__, ENGINES
+    parser = argparse.ArgumentParser(
+        prog='samplitude bench',
+        description='Benchmark the samplitude generators, filters and'
+                    ' consumers.')
+    parser.add_argument('names', nargs='*',
+                        help='only run these generators, filters or consumers')
+    parser.add_argument('--sizes', default='10000,100000,1000000',
+                        help='comma separated sample sizes')
+    parser.add_argument('--engine', choices=ENGINES, default='python')
+    parser.add_argument('--chunksize', type=int)
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='report the best of this many runs')
+    parser.add_argument('--no-memory', action='store_true',
+                        help='do not measure peak memory (faster)')
+    parser.add_argument('--json', action='store_true',
+                        help='write the results as JSON')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='JSON results of an earlier run to compare with')
+    args = parser.parse_args(argv)
+
+    sizes = [int(float(n)) for n in args.sizes.split(',')]
+    results = bench(args.names, sizes, engine=args.engine,
+                    chunksize=args.chunksize, repeat=args.repeat,
+                    memory=not args.no_memory)
+    if args.json:
+        json.dump({'version': __version__, 'python': sys.version.split()[0],
+                   'results': results}, sys.stdout, indent=1)
+        sys.stdout.write('\n')
+        return
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+    _report(results, sys.stdout, baseline)
@@ -0,0 +1,180 @@
+"""Bounded-size summaries of streams for plotting, fed one array at a time."""
+
+import numpy as np
+
+
+class _Histogram(object):
+    """Histogram of a stream of `dims`-dimensional points, with `bins` bins
+    along each axis.
+
+    The range is taken from the first chunk, and whenever a later point falls
+    outside of it, the range of that axis is doubled (towards the point) by
+    merging pairs of adjacent bins.  Hence the number of bins never changes
+    and the counts are exact for the resulting bins.  Alternatively, `edges`
+    gives fixed bin edges (one-dimensional only), outside of which points are
+    ignored, as in `np.histogram`.
+
+    """
+    def __init__(self, bins=None, dims=1, edges=None):
+        self.bins = bins
+        self.dims = dims
+        self.edges = None if edges is None else np.asarray(edges, dtype=float)
+        self.counts = None
+        self.lo = self.width = None
+        if self.edges is not None:
+            self.counts = np.zeros(len(self.edges) - 1, dtype=np.int64)
+
+    def _start(self, points):
+        if self.bins is None:
+            auto = np.histogram_bin_edges(points[:, 0], bins='auto')
+            self.bins = min(max(len(auto) - 1, 10), 1000)
+        lo, hi = points.min(axis=0), points.max(axis=0)
+        self.width = (hi - lo) / self.bins
+        flat = self.width == 0
+        self.width[flat] = np.maximum(abs(lo[flat]), 1.0) / self.bins
+        lo[flat] -= self.width[flat] * self.bins / 2
+        self.lo = lo
+        self.counts = np.zeros((self.bins,) * self.dims, dtype=np.int64)
+
+    def _grow(self, axis, down):
+        pad = [(0, 0)] * self.dims
+        pad[axis] = (self.bins % 2, 0) if down else (0, self.bins % 2)
+        counts = np.pad(self.counts, pad)
+        n = counts.shape[axis]
+        merged = (counts.take(range(0, n, 2), axis=axis) +
+                  counts.take(range(1, n, 2), axis=axis))
+        shape = list(merged.shape)
+        shape[axis] = self.bins - shape[axis]
+        zeros = np.zeros(shape, dtype=np.int64)
+        parts = (zeros, merged) if down else (merged, zeros)
+        self.counts = np.concatenate(parts, axis=axis)
+        if down:
+            self.lo[axis] -= self.bins * self.width[axis]
+        self.width[axis] *= 2
+
+    def add(self, points):
+        points = np.asarray(points, dtype=float).reshape(-1, self.dims)
+        points = points[np.isfinite(points).all(axis=1)]
+        if not len(points):
+            return
+        if self.edges is not None:
+            self.counts += np.histogram(points[:, 0], self.edges)[0]
+            return
+        if self.counts is None:
+            self._start(points)
+        lo, hi = points.min(axis=0), points.max(axis=0)
+        for axis in range(self.dims):
+            while lo[axis] < self.lo[axis]:
+                self._grow(axis, down=True)
+            while hi[axis] >= self.lo[axis] + self.bins * self.width[axis]:
+                self._grow(axis, down=False)
+        idx = np.floor((points - self.lo) / self.width).astype(np.int64)
+        idx = np.clip(idx, 0, self.bins - 1)
+        flat = np.ravel_multi_index(idx.T, self.counts.shape)
+        self.counts += np.bincount(
+            flat, minlength=self.counts.size).reshape(self.counts.shape)
+
+    def bin_edges(self, axis=0):
+        if self.edges is not None:
+            return self.edges
+        return self.lo[axis] + self.width[axis] * np.arange(self.bins + 1)
+
+
+class _Decimator(object):
+    """Min/max decimation of a stream, for line plots.
+
+    The stream is split into buckets of `stride` consecutive elements, of
+    which only the minimum and maximum are kept.  When there are `2 * points`
+    buckets, the stride is doubled by merging pairs of buckets, so at most
+    `4 * points` values are kept, and drawing the minimum and maximum of each
+    bucket looks just like drawing the entire stream.
+
+    """
+    def __init__(self, points=2000):
+        self.points = points
+        self.stride = 1
+        self.n = 0
+        self.mins = np.empty(0)
+        self.maxs = np.empty(0)
+        self._last = 0  # the number of elements in the last bucket
+
+    def _merge(self):
+        mins, maxs = self.mins, self.maxs
+        if len(mins) % 2:
+            mins, maxs = np.append(mins, mins[-1]), np.append(maxs, maxs[-1])
+        else:
+            self._last += self.stride
+        self.mins = np.minimum(mins[::2], mins[1::2])
+        self.maxs = np.maximum(maxs[::2], maxs[1::2])
+        self.stride *= 2
+
+    def add(self, values):
+        values = np.asarray(values, dtype=float)
+        self.n += len(values)
+        while len(values):
+            if len(self.mins) and self._last < self.stride:
+                head = values[:self.stride - self._last]
+                values = values[len(head):]
+                self.mins[-1] = min(self.mins[-1], head.min())
+                self.maxs[-1] = max(self.maxs[-1], head.max())
+                self._last += len(head)
+                continue
+            room = 2 * self.points - len(self.mins)
+            chunk, values = (values[:room * self.stride],
+                             values[room * self.stride:])
+            full = len(chunk) // self.stride * self.stride
+            buckets = chunk[:full].reshape(-1, self.stride)
+            mins, maxs = buckets.min(axis=1), buckets.max(axis=1)
+            self._last = self.stride
+            if full < len(chunk):
+                rest = chunk[full:]
+                mins = np.append(mins, rest.min())
+                maxs = np.append(maxs, rest.max())
+                self._last = len(rest)
+            self.mins = np.concatenate((self.mins, mins))
+            self.maxs = np.concatenate((self.maxs, maxs))
+            while len(self.mins) >= 2 * self.points:
+                self._merge()
+
+    def line(self):
+        """The x and y values of the decimated line."""
+        x = np.arange(len(self.mins)) * self.stride
+        if self.stride == 1:
+            return x, self.mins
+        return (np.repeat(x, 2),
+                np.column_stack((self.mins, self.maxs)).ravel())
+
+
+class _Reservoir(object):
+    """Uniform random sample of at most `k` rows of a stream, in order.
+
+    Every row gets a random key, and the rows with the `k` smallest keys are
+    kept (bottom-k sampling), which is done one array at a time.
+
+    """
+    def __init__(self, k, rng):
+        self.k = k
+        self.n = 0
+        self._rng = rng
+        self._keys = np.empty(0)
+        self._index = np.empty(0, dtype=np.int64)
+        self._rows = None
+
+    def add(self, rows):
+        rows = np.asarray(rows, dtype=float)
+        keys = self._rng.random(len(rows))
+        index = np.arange(self.n, self.n + len(rows))
+        self.n += len(rows)
+        if self._rows is not None:
+            rows = np.concatenate((self._rows, rows))
+            keys = np.concatenate((self._keys, keys))
+            index = np.concatenate((self._index, index))
+        if len(keys) > self.k:
+            keep = np.argpartition(keys, self.k)[:self.k]
+            rows, keys, index = rows[keep], keys[keep], index[keep]
+        self._rows, self._keys, self._index = rows, keys, index
+
+    def rows(self):
+        if self._rows is None:
+            return np.empty((0, 2))
+        return self._rows[np.argsort(self._index)]
@@ -0,0 +1,177 @@
+import functools
+import itertools
+
+CHUNKSIZE = 2**16
+
+
+def _is_blocked(gen):
+    return getattr(gen, 'blocked', False)
+
+
+def _as_count(n):
+    """The number of elements `n` as an int, e.g. 10 for `sample(1e1)`."""
+    if isinstance(n, int):
+        return n
+    if not float(n).is_integer():
+        raise ValueError('expected a whole number of elements, not %r' % (n,))
+    return int(n)
+
+
+class _Blocked(object):
+    """A stream of elements that is produced in NumPy array blocks.
+
+    Iterating gives one (Python) element at a time, whereas `blocks` hands out
+    the remaining elements as arrays.  Subclasses implement `_next_block(k)`,
+    returning an array of (preferably) at most `k` elements, or `None` when
+    exhausted.
+
+    """
+    blocked = True
+    chunksize = CHUNKSIZE
+
+    _pending = None
+    _elements = ()
+    _pos = 0
+
+    def _next_block(self, k):
+        raise NotImplementedError
+
+    def blocks(self, n=None):
+        """Yield the remaining elements as arrays, at most `n` in total."""
+        while n is None or n > 0:
+            k = self.chunksize if n is None else min(n, self.chunksize)
+            if self._pending is not None and self._pos < len(self._pending):
+                block = self._pending[self._pos:self._pos + k]
+            else:
+                self._pending = self._next_block(k)
+                self._elements = ()
+                self._pos = 0
+                if self._pending is None:
+                    return
+                block = self._pending[:k]
+            self._pos += len(block)
+            if n is not None:
+                n -= len(block)
+            yield block
+
+    def _skip_pending(self, n):
+        """Skip at most `n` elements of the pending block; return the rest."""
+        if self._pending is not None:
+            k = min(n, len(self._pending) - self._pos)
+            self._pos += k
+            n -= k
+        return n
+
+    def skip(self, n):
+        """Skip the next `n` elements, discarding whole blocks (of at least
+        the default size, as the blocks do not change the stream)."""
+        n = self._skip_pending(n)
+        while n > 0:
+            block = self._next_block(min(n, max(self.chunksize, CHUNKSIZE)))
+            if block is None:
+                return
+            if len(block) > n:
+                self._pending, self._elements, self._pos = block, (), n
+                return
+            n -= len(block)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while self._pending is None or self._pos >= len(self._pending):
+            self._pending = self._next_block(self.chunksize)
+            self._pos = 0
+            if self._pending is None:
+                raise StopIteration
+            self._elements = self._pending.tolist()
+        if not self._elements:
+            self._elements = self._pending.tolist()
+        v = self._elements[self._pos]
+        self._pos += 1
+        return v
+
+
+class _BlockGenerator(_Blocked):
+    """Infinite stream where `draw(k)` gives an array of `k` samples.
+
+    If given, `advance(n)` moves the stream `n` samples ahead without drawing
+    them, e.g. by advancing the bit generator, and is used by `skip`.
+
+    """
+    is_infinite = True
+
+    def __init__(self, draw, chunksize=None, advance=None):
+        self._draw = draw
+        self._advance = advance
+        if chunksize is not None:
+            self.chunksize = chunksize
+
+    def _next_block(self, k):
+        return self._draw(k)
+
+    def skip(self, n):
+        if self._advance is None:
+            return _Blocked.skip(self, n)
+        n = self._skip_pending(n)
+        if n > 0:
+            self._advance(n)
+
+
+class _Limited(_Blocked):
+    """The first `n` elements of the blocked stream `source`."""
+
+    def __init__(self, source, n):
+        self._source = source
+        self._remaining = _as_count(n)
+        self.chunksize = source.chunksize
+
+    def skip(self, n):
+        n = min(self._skip_pending(n), self._remaining)
+        self._source.skip(n)
+        self._remaining -= n
+
+    def _next_block(self, k):
+        for block in self._source.blocks(min(k, self._remaining)):
+            self._remaining -= len(block)
+            return block
+        return None
+
+
+class _BlockStream(_Blocked):
+    """Blocked stream over an iterator of arrays, e.g. the output of a filter."""
+
+    def __init__(self, blocks, chunksize=None, infinite=False):
+        self._blocks = blocks
+        if chunksize is not None:
+            self.chunksize = chunksize
+        if infinite:
+            self.is_infinite = True
+
+    def _next_block(self, k):
+        return next(self._blocks, None)
+
+
+def _is_plain(args, kwargs):
+    plain = (int, float, complex, type(None))
+    return all(isinstance(arg, plain) or _is_blocked(arg)
+               for arg in itertools.chain(args, kwargs.values()))
+
+
+def _block_filter(func, blocks):
+    """Filter calling `blocks` on the array blocks of a blocked input.
+
+    The block function takes an iterator over arrays and the filter arguments,
+    and must yield arrays.  If the input is not blocked, or the arguments are
+    not plain numbers (or blocked streams), the element-wise `func` is used
+    instead.
+
+    """
+    @functools.wraps(func)
+    def _inner(gen, *args, **kwargs):
+        if _is_blocked(gen) and _is_plain(args, kwargs):
+            return _BlockStream(blocks(gen.blocks(), *args, **kwargs),
+                                chunksize=gen.chunksize,
+                                infinite=getattr(gen, 'is_infinite', False))
+        return func(gen, *args, **kwargs)
+    return _inner
@@ -0,0 +1,42 @@
+"""The client of the server (see `_server`), kept apart from it so that a
+request only imports what it needs to send the expression.
+
+"""
+
+import array
+import json
+import socket
+import sys
+
+_STREAMS = 3  # the file descriptors of stdin, stdout and stderr
+
+
+def _read_line(sock, data=b''):
+    while not data.endswith(b'\n'):
+        chunk = sock.recv(2**16)
+        if not chunk:
+            raise ConnectionError('connection closed')
+        data += chunk
+    return json.loads(data.decode())
+
+
+def request(path, message):
+    """Send the request `message` (a dict) to the server at `path`, with the
+    standard streams of this process, and return the exit status, or None if
+    no server is listening on `path`."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        sock.close()
+        return None
+    with sock:
+        sys.stdout.flush()
+        fds = [sys.stdin.fileno(), sys.stdout.fileno(), sys.stderr.fileno()]
+        sock.sendmsg([json.dumps(message).encode() + b'\n'],
+                     [(socket.SOL_SOCKET, socket.SCM_RIGHTS,
+                       array.array('i', fds))])
+        try:
+            return _read_line(sock)['status']
+        except (ConnectionError, ValueError):
+            return 1  # the server went away
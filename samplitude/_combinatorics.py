@@ -0,0 +1,139 @@
+"""Lazy products, permutations and combinations with length and indexing."""
+
+import functools
+import itertools
+import math
+import operator
+
+from ._utils import _set
+
+_COMBINERS = {
+    'add': operator.add, '+': operator.add,
+    'minus': operator.sub, 'sub': operator.sub, '-': operator.sub,
+    'mul': operator.mul, '*': operator.mul,
+    'div': operator.truediv, '/': operator.truediv,
+    'idiv': operator.floordiv, '//': operator.floordiv,
+}
+
+
+def _is_combiner(name):
+    return isinstance(name, str) and (
+        name in _COMBINERS or name in ('tuple', 'set') or
+        name.startswith('concat'))
+
+
+def _combiner(name):
+    """A function combining a tuple of elements, one of each input."""
+    if name is None or name == 'tuple':
+        return tuple
+    if name == 'set':
+        return _set
+    if name.startswith('concat'):
+        return lambda xs: ''.join(map('{}'.format, xs))
+    if name in _COMBINERS:
+        return functools.partial(functools.reduce, _COMBINERS[name])
+    raise ValueError('unknown combiner %r' % name)
+
+
+def _pool(gen):
+    """`gen` if it can be indexed (e.g. a range), otherwise its elements."""
+    if (hasattr(gen, '__getitem__') and hasattr(gen, '__len__') and
+            not isinstance(gen, dict)):
+        return gen
+    return tuple(gen)
+
+
+class _Combinatoric(object):
+    """A lazy, finite sequence of combinatorial objects.
+
+    Iterating enumerates them (in the order of `itertools`), `size` is their
+    number (also when too large for `len`), and indexing gives the `i`-th one
+    directly, so e.g. `choice` draws uniformly without enumerating them.
+
+    """
+    size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, i):
+        if not isinstance(i, int):
+            raise TypeError('indices must be integers')
+        if i < 0:
+            i += self.size
+        if not 0 <= i < self.size:
+            raise IndexError('index out of range')
+        return self._nth(i)
+
+    def _nth(self, i):
+        raise NotImplementedError
+
+    def __iter__(self):
+        raise NotImplementedError
+
+
+class _Product(_Combinatoric):
+    """The cross product of `pools`, each tuple combined by `combiner`."""
+
+    def __init__(self, pools, combiner=None):
+        self._pools = [_pool(p) for p in pools]
+        self._combine = _combiner(combiner)
+        self.size = math.prod(len(p) for p in self._pools)
+
+    def __iter__(self):
+        return map(self._combine, itertools.product(*self._pools))
+
+    def _nth(self, i):
+        elements = []
+        for pool in reversed(self._pools):
+            i, j = divmod(i, len(pool))
+            elements.append(pool[j])
+        return self._combine(tuple(reversed(elements)))
+
+
+class _Permutations(_Combinatoric):
+
+    def __init__(self, pool, r=None):
+        self._pool = _pool(pool)
+        n = len(self._pool)
+        self._r = n if r is None else r
+        self.size = math.perm(n, self._r)
+
+    def __iter__(self):
+        return itertools.permutations(self._pool, self._r)
+
+    def _nth(self, i):
+        n, r = len(self._pool), self._r
+        left = list(range(n))
+        elements = []
+        for k in range(r):
+            j, i = divmod(i, math.perm(n - k - 1, r - k - 1))
+            elements.append(self._pool[left.pop(j)])
+        return tuple(elements)
+
+
+class _Combinations(_Combinatoric):
+
+    def __init__(self, pool, r):
+        self._pool = _pool(pool)
+        self._r = r
+        self.size = math.comb(len(self._pool), r)
+
+    def __iter__(self):
+        return itertools.combinations(self._pool, self._r)
+
+    def _nth(self, i):
+        n, r = len(self._pool), self._r
+        elements = []
+        j = 0
+        for k in range(r):
+            # skip the combinations starting with the elements before j
+            while True:
+                count = math.comb(n - j - 1, r - k - 1)
+                if i < count:
+                    break
+                i -= count
+                j += 1
+            elements.append(self._pool[j])
+            j += 1
+        return tuple(elements)
@@ -1,19 +1,83 @@
+import itertools
 import math
 
-def sinegenerator(rate):
-    num = 0
-    while True:
-        yield math.sin(num*rate)
-        num += 1
-
-def cosinegenerator(rate):
-    num = 0
-    while True:
-        yield math.cos(num*rate)
-        num += 1
-
-def tangenerator(rate):
-    num = 0
-    while True:
-        yield math.tan(num*rate)
-        num += 1
+from ._blocks import _Blocked
+
+
+class _Wave(_Blocked):
+    """The infinite sequence `amplitude * func(i * rate + phase)`, i = 0, 1, ...
+
+    `func` is the name of a function in both `math` and NumPy.  The sequence
+    is computed one element at a time, or in NumPy blocks if `blocked`.
+    Since the elements are given by their index, `skip(n)` and indexing are
+    O(1).
+
+    """
+    is_infinite = True
+
+    def __init__(self, func, rate, amplitude=1, phase=0, blocked=False,
+                 chunksize=None):
+        self._func = func
+        self._rate = rate
+        self._amplitude = amplitude
+        self._phase = phase
+        self._i = 0  # the index of the next element (or block) to compute
+        self.blocked = blocked
+        if chunksize is not None:
+            self.chunksize = chunksize
+
+    def __getitem__(self, i):
+        x = i * self._rate
+        if self._phase:
+            x += self._phase
+        return self._amplitude * getattr(math, self._func)(x)
+
+    def skip(self, n):
+        self._i += self._skip_pending(n)
+
+    def _next_block(self, k):
+        import numpy as np
+        x = np.arange(self._i, self._i + k) * self._rate
+        if self._phase:
+            x += self._phase
+        self._i += k
+        return self._amplitude * getattr(np, self._func)(x)
+
+    def __next__(self):
+        if self.blocked:
+            return _Blocked.__next__(self)
+        v = self[self._i]
+        self._i += 1
+        return v
+
+
+def sinegenerator(rate, amplitude=1, phase=0, blocked=False, chunksize=None):
+    return _Wave('sin', rate, amplitude, phase, blocked, chunksize)
+
+
+def cosinegenerator(rate, amplitude=1, phase=0, blocked=False, chunksize=None):
+    return _Wave('cos', rate, amplitude, phase, blocked, chunksize)
+
+
+def tangenerator(rate, amplitude=1, phase=0, blocked=False, chunksize=None):
+    return _Wave('tan', rate, amplitude, phase, blocked, chunksize)
+
+
+class _Count(object):
+    """The numbers `start, start + step, ...` as `itertools.count`, but which
+    can be indexed and skipped ahead in O(1).  Like a range, iterating starts
+    anew (from where `skip` left it) every time."""
+    is_infinite = True
+
+    def __init__(self, start=0, step=1):
+        self._start = start
+        self._step = step
+
+    def __getitem__(self, i):
+        return self._start + i * self._step
+
+    def skip(self, n):
+        self._start += n * self._step
+
+    def __iter__(self):
+        return itertools.count(self._start, self._step)
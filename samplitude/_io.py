@@ -0,0 +1,100 @@
+import csv
+import struct
+
+NPY_HEADER_LEN = 128  # leaves room for any shape, keeps 64-byte alignment
+
+
+def _npy_header(dtype, n):
+    """A fixed-size `.npy` (version 1.0) header for `n` elements of `dtype`."""
+    import numpy as np
+    descr = np.lib.format.dtype_to_descr(np.dtype(dtype))
+    header = "{'descr': %r, 'fortran_order': False, 'shape': (%d,), }" % (
+        descr, n)
+    header = header.ljust(NPY_HEADER_LEN - 11) + '\n'
+    return (b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) +
+            header.encode('latin1'))
+
+
+class _NpyWriter(object):
+    """Write a one-dimensional `.npy` file chunk by chunk.
+
+    The header is written with a placeholder length, which is filled in when
+    the writer is closed, so the number of elements need not be known.
+
+    """
+    def __init__(self, path, dtype='float64'):
+        self.dtype = dtype
+        self.n = 0
+        self._f = open(path, 'wb')
+        self._f.write(_npy_header(dtype, 0))
+
+    def write(self, arr):
+        arr.astype(self.dtype, copy=False).tofile(self._f)
+        self.n += len(arr)
+
+    def close(self):
+        self._f.seek(0)
+        self._f.write(_npy_header(self.dtype, self.n))
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _parse_field(field):
+    """A csv field as an int, float (NaN if empty) or string, as pandas does."""
+    for kind in (int, float):
+        try:
+            return kind(field)
+        except ValueError:
+            pass
+    return float('nan') if field == '' else field
+
+
+def _csv_lists(fname, col=None, sep=None, chunksize=65536):
+    """Lists of the values in column `col` of a csv file, with `csv`."""
+    with open(fname, newline='') as f:
+        reader = csv.reader(f, delimiter=sep or ',')
+        header = next(reader, None)
+        if header is None:
+            return
+        if col is None:
+            col = 0
+        elif not isinstance(col, int):
+            if col not in header:
+                raise ValueError('no column %r in %s' % (col, fname))
+            col = header.index(col)
+        chunk = []
+        for row in reader:
+            if row:
+                chunk.append(_parse_field(row[col]))
+            if len(chunk) == chunksize:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def _csv_chunks(fname, col=None, sep=None, chunksize=65536):
+    """Iterate over column `col` (index or name, default the first) of a csv
+    file in chunks of at most `chunksize` values.
+
+    Only this column is parsed, by pandas (giving arrays) if it is available,
+    otherwise by the `csv` module (giving lists).
+
+    """
+    try:
+        import pandas as pd
+    except ImportError:
+        yield from _csv_lists(fname, col, sep, chunksize)
+        return
+    sep = sep or ','
+    if col is None or isinstance(col, int):
+        col = pd.read_csv(fname, sep=sep, nrows=0).columns[col or 0]
+    with pd.read_csv(fname, sep=sep, usecols=[col],
+                     chunksize=chunksize) as reader:
+        for chunk in reader:
+            yield chunk[col].to_numpy()
@@ -0,0 +1,137 @@
+"""The lines of a text file, streamed, or accessed at random through an index."""
+
+import hashlib
+import locale
+import mmap
+import os
+
+_READ_SIZE = 2**24
+
+
+def _cache_dir():
+    cache = os.getenv('SAMPLITUDE_CACHE')
+    if cache is None:
+        cache = os.path.join(
+            os.getenv('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+            'samplitude')
+    return cache
+
+
+def _index_path(fname):
+    digest = hashlib.sha1(os.path.abspath(fname).encode()).hexdigest()
+    return os.path.join(_cache_dir(), 'lines-%s.npy' % digest)
+
+
+def _build_index(fname):
+    """Offsets of the starts of the lines of `fname`, and of its end."""
+    import numpy as np
+    starts, pos = [np.zeros(1, dtype=np.int64)], 0
+    with open(fname, 'rb') as f:
+        while True:
+            buf = f.read(_READ_SIZE)
+            if not buf:
+                break
+            newlines = np.flatnonzero(np.frombuffer(buf, dtype=np.uint8) == 10)
+            starts.append(newlines + (pos + 1))
+            pos += len(buf)
+    starts = np.concatenate(starts)
+    if starts[-1] == pos:  # no line after the last newline
+        starts = starts[:-1]
+    return np.append(starts, pos)
+
+
+def _line_index(fname):
+    """The line offsets of `fname`, see `_build_index`.
+
+    The index is cached in `SAMPLITUDE_CACHE` (default
+    `~/.cache/samplitude`) together with the size and modification time of
+    the file, and rebuilt when they change.  Cached indices are memory
+    mapped, so also the index of a huge file is loaded instantly.
+
+    """
+    import numpy as np
+    stat = os.stat(fname)
+    key = (stat.st_size, stat.st_mtime_ns)
+    path = _index_path(fname)
+    try:
+        cached = np.load(path, mmap_mode='r')
+        if tuple(cached[:2]) == key:
+            return cached[2:]
+    except (OSError, ValueError):
+        pass
+    offsets = _build_index(fname)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp, 'wb') as f:
+            np.save(f, np.concatenate((key, offsets)).astype(np.int64))
+        os.replace(tmp, path)
+    except OSError:
+        pass  # e.g. a read-only cache directory, just do without
+    return offsets
+
+
+class _IndexedLines(object):
+    """Random access to the lines of `fname` through its line index (see
+    `_line_index`) and a memory map, never loading the entire file."""
+
+    def __init__(self, fname, clean, encoding):
+        self._offsets = _line_index(fname)
+        self._clean = clean
+        self._encoding = encoding
+        self._map = None
+        if len(self._offsets) > 1:
+            with open(fname, 'rb') as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        i = range(len(self))[i]  # IndexError if out of range
+        line = self._map[int(self._offsets[i]):int(self._offsets[i + 1])]
+        return self._clean(line.decode(self._encoding))
+
+
+class _FileLines(object):
+    """The lines of the text file `fname`, without line endings.
+
+    Iterating streams the lines (through a memory map if `mmap`), whereas
+    `random_access` gives an indexed sequence of the lines, used by e.g.
+    `choice` and `len`.  With `strip`, surrounding whitespace is removed from
+    every line.
+
+    """
+    def __init__(self, fname, mmap=False, strip=False):
+        self.fname = fname
+        self._mmap = mmap
+        self._strip = strip
+        self._indexed = None
+        self._encoding = locale.getpreferredencoding(False)
+
+    def _clean(self, line):
+        return line.strip() if self._strip else line.rstrip('\r\n')
+
+    def __iter__(self):
+        if self._mmap:
+            return self._mmap_lines()
+        return self._text_lines()
+
+    def _text_lines(self):
+        with open(self.fname, 'r', newline='\n') as f:
+            for line in f:
+                yield self._clean(line)
+
+    def _mmap_lines(self):
+        with open(self.fname, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                for line in iter(m.readline, b''):
+                    yield self._clean(line.decode(self._encoding))
+
+    def random_access(self):
+        if self._indexed is None:
+            self._indexed = _IndexedLines(self.fname, self._clean,
+                                          self._encoding)
+        return self._indexed
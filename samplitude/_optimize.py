@@ -0,0 +1,156 @@
+"""Rewrites of the filter stages of a natively compiled pipe (see `_pipes`).
+
+The rewrites only use what the filters declare about themselves (see
+`_Samplitude.filter`), and never change the result of an expression:
+
+* A limit (`sample(n)`, `head(n)`) is copied in front of the elementwise
+  stages before it, so that e.g. the generator in `normal(0, 1) | scale(2) |
+  sample(10)` only draws 10 samples rather than a whole block.
+* A stage with `first_n` followed by a limit only computes the first `n`
+  elements, e.g. `sort | head(k)` is a heap based top-k.
+* Adjacent elementwise stages with a `{x}` template and constant arguments,
+  e.g. `scale(2) | shift(1) | round(2)`, are fused into a single function
+  mapped over the elements, `round(x * 2 + 1, 2)`.
+
+"""
+
+import inspect
+
+from ._blocks import _is_blocked
+
+_NUMBERS = (int, float, complex)
+
+
+class _Stage(object):
+    """A filter `func` with `args` and `kwargs` (functions of no arguments),
+    and their values in `constants` (args, kwargs) if they are constant."""
+
+    def __init__(self, func, args, kwargs, constants=None):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.constants = constants
+
+    def __call__(self, value):
+        if not self.args and not self.kwargs:
+            return self.func(value)
+        return self.func(value, *[arg() for arg in self.args],
+                         **{k: v() for k, v in self.kwargs})
+
+    def bound(self):
+        """The constant arguments by parameter name, or None."""
+        if self.constants is None:
+            return None
+        args, kwargs = self.constants
+        try:
+            bound = inspect.signature(self.func).bind(None, *args, **kwargs)
+        except (TypeError, ValueError):
+            return None  # let calling the filter raise the error
+        bound.apply_defaults()
+        return dict(list(bound.arguments.items())[1:])
+
+
+class _FirstN(_Stage):
+    """The first `n` elements of `stage`, by its `first_n`."""
+
+    def __init__(self, stage, n):
+        _Stage.__init__(self, stage.func, stage.args, stage.kwargs)
+        self._n = n
+
+    def __call__(self, value):
+        return self.func.first_n(value, self._n,
+                                 *[arg() for arg in self.args],
+                                 **{k: v() for k, v in self.kwargs})
+
+
+class _Fused(object):
+    """Elementwise `stages`, as one function mapped over the elements.
+
+    Blocked input is passed through the stages as usual, since their block
+    versions are vectorized already.
+
+    """
+    def __init__(self, stages, bounds):
+        namespace = {'round': round, 'int': int}
+        expr = 'x'
+        for i, (stage, bound) in enumerate(zip(stages, bounds)):
+            names = {}
+            for param, value in bound.items():
+                names[param] = '_%s%d' % (param, i)
+                namespace[names[param]] = value
+            expr = stage.func.elementwise.format(x=expr, **names)
+        self._stages = stages
+        self._func = eval('lambda x: %s' % expr, namespace)
+
+    def __call__(self, value):
+        if _is_blocked(value):
+            for stage in self._stages:
+                value = stage(value)
+            return value
+        return map(self._func, value)
+
+
+def _limit(stage):
+    """`n` if `stage` is a constant limit `sample(n)` or `head(n)`."""
+    if getattr(stage.func, 'is_prefix', False):
+        bound = stage.bound()
+        if bound:
+            n = next(iter(bound.values()))
+            if isinstance(n, int):
+                return n
+    return None
+
+
+def _fusible(stage):
+    bound = stage.bound()
+    if not isinstance(getattr(stage.func, 'elementwise', None), str) or \
+            bound is None:
+        return None
+    if not all(isinstance(v, _NUMBERS) for v in bound.values()):
+        return None
+    return bound
+
+
+def _push_limits(stages):
+    result = []
+    for stage in stages:
+        if _limit(stage) is not None:
+            i = len(result)
+            while i > 0 and getattr(result[i - 1].func, 'elementwise', None):
+                i -= 1
+            if i < len(result):
+                result.insert(i, stage)
+        result.append(stage)
+    return result
+
+
+def _first_n(stages):
+    result = list(stages)
+    for i in range(len(result) - 1):
+        n = _limit(result[i + 1])
+        if n is not None and hasattr(result[i].func, 'first_n'):
+            result[i] = _FirstN(result[i], n)
+    return result
+
+
+def _fuse(stages):
+    result, run, bounds = [], [], []
+    for stage in stages + [None]:
+        bound = _fusible(stage) if stage is not None else None
+        if bound is not None:
+            run.append(stage)
+            bounds.append(bound)
+            continue
+        if len(run) > 1:
+            result.append(_Fused(run, bounds))
+        else:
+            result.extend(run)
+        run, bounds = [], []
+        if stage is not None:
+            result.append(stage)
+    return result
+
+
+def _optimize(stages):
+    """The list of `_Stage`s rewritten as described above."""
+    return _fuse(_first_n(_push_limits(stages)))
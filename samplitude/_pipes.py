@@ -0,0 +1,284 @@
+"""A compiler of samplitude expressions to plain Python callables.
+
+An expression such as `normal(0, 1) | sample(10) | round(2) | list` is parsed
+with Python's `ast` (where `|` is a binary or) and compiled to nested
+closures calling the registered generators and filters directly, without
+going through Jinja2.  Only the part of the Jinja2 expression language that
+means the same in Python is accepted: literals, names, calls of generators,
+filters (with arguments), and arithmetic.  For anything else, e.g. Jinja2
+built-in filters other than those in `_BUILTIN_FILTERS`, attribute access,
+tests or conditional expressions, `_compile` raises `_Unsupported`, and the
+expression is left to Jinja2.
+
+The filter stages of every pipe are rewritten by `_optimize`.  With a
+`profiler` (see `_profile`), every generator and filter call is wrapped by it.
+
+"""
+
+import ast
+import itertools
+import operator
+
+from ._optimize import _Stage, _optimize
+
+_BINARY = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+}
+
+_UNARY = {
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+}
+
+_CONSTANTS = {'true': True, 'True': True, 'false': False, 'False': False,
+              'none': None, 'None': None}
+
+_BUILTIN_GLOBALS = {'range': range, 'dict': dict}
+
+
+class _Unsupported(Exception):
+    """The expression cannot be compiled natively, and needs Jinja2."""
+
+
+def _ignore_case(value):
+    return value.lower() if isinstance(value, str) else value
+
+
+def _min_or_max(func, value, case_sensitive=False):
+    it = iter(value)
+    for first in it:
+        key = None if case_sensitive else _ignore_case
+        return func(itertools.chain([first], it), key=key)
+    return ''  # like the undefined value of Jinja2, printed as nothing
+
+
+#  The Jinja2 built-in filters used in samplitude expressions, with the same
+#  behavior (for the given arguments), so that they do not require Jinja2:
+#  the function, and the parameters it accepts positionally (in the order
+#  of the Jinja2 filter, e.g. not `start`, which follows `attribute` in
+#  `sum`) and as keywords.
+_BUILTIN_FILTERS = {
+    'list': (list, (), ()),
+    'length': (len, (), ()),
+    'count': (len, (), ()),
+    'sum': (lambda value, start=0: sum(value, start), (), ('start',)),
+    'max': (lambda value, case_sensitive=False:
+            _min_or_max(max, value, case_sensitive), ('case_sensitive',),
+            ('case_sensitive',)),
+    'min': (lambda value, case_sensitive=False:
+            _min_or_max(min, value, case_sensitive), ('case_sensitive',),
+            ('case_sensitive',)),
+}
+
+
+class _Pipeline(object):
+    """A natively compiled expression.
+
+    Calling it evaluates the expression.  `stages` are the generators and
+    filters along the pipe, from the last filter back to the source, and
+    `arguments` has a pair `(func, stages)` for every pipe (or generator)
+    given as an argument to the generator or filter `func`, as used by the
+    checks of the expression.
+
+    """
+    def __init__(self, source, evaluate, stages, arguments=()):
+        self.source = source
+        self._evaluate = evaluate
+        self.stages = stages
+        self.arguments = arguments
+
+    def __call__(self):
+        return self._evaluate()
+
+
+def _compile(source, generators, filters, profiler=None):
+    """Compile the expression `source` to a `_Pipeline`, calling the
+    `generators` and `filters` (dicts of name to function) by name."""
+    try:
+        tree = ast.parse(source.strip(), mode='eval')
+    except SyntaxError:
+        raise _Unsupported('not a Python expression')
+    compiler = _Compiler(generators, filters, profiler)
+    evaluate = compiler.compile(tree.body)
+    return _Pipeline(source, evaluate, compiler.stages(tree.body),
+                     compiler.arguments)
+
+
+def _is_pipe(node):
+    return isinstance(node, ast.BinOp) and isinstance(node.op, ast.BitOr)
+
+
+class _Compiler(object):
+
+    def __init__(self, generators, filters, profiler=None):
+        self._generators = dict(_BUILTIN_GLOBALS, **generators)
+        self._filters = filters
+        self._profiler = profiler
+        self.arguments = []
+
+    def stages(self, node):
+        stages = []
+        while _is_pipe(node):
+            name = _filter_call(node.right)[0]
+            stages.append(self._filter(name)[0])
+            node = node.left
+        if isinstance(node, ast.Call):
+            node = node.func
+        if isinstance(node, ast.Name) and node.id in self._generators:
+            stages.append(self._generators[node.id])
+        return stages
+
+    def _filter(self, name):
+        if name in self._filters:
+            return self._filters[name], None, None
+        if name in _BUILTIN_FILTERS:
+            return _BUILTIN_FILTERS[name]
+        raise _Unsupported('unknown filter %s' % name)
+
+    def compile(self, node):
+        method = getattr(self, '_' + node.__class__.__name__, None)
+        if method is None:
+            raise _Unsupported(node.__class__.__name__)
+        return method(node)
+
+    def _arguments(self, args, keywords):
+        if any(isinstance(arg, ast.Starred) for arg in args) or \
+                any(kw.arg is None for kw in keywords):
+            raise _Unsupported('star arguments')
+        args = [self.compile(arg) for arg in args]
+        kwargs = [(kw.arg, self.compile(kw.value)) for kw in keywords]
+        return args, kwargs
+
+    def _Constant(self, node):
+        value = node.value
+        # literals of Python only, e.g. `1j`, are syntax errors in Jinja2
+        if isinstance(value, (bytes, complex)) or value is Ellipsis:
+            raise _Unsupported('constant %r' % value)
+        return lambda: value
+
+    def _Name(self, node):
+        if node.id in _CONSTANTS:
+            value = _CONSTANTS[node.id]
+        elif node.id in self._generators:
+            value = self._generators[node.id]
+        else:
+            raise _Unsupported('unknown name %s' % node.id)
+        return lambda: value
+
+    def _List(self, node):
+        elts = [self.compile(elt) for elt in node.elts]
+        return lambda: [elt() for elt in elts]
+
+    def _Tuple(self, node):
+        elts = [self.compile(elt) for elt in node.elts]
+        return lambda: tuple(elt() for elt in elts)
+
+    def _Dict(self, node):
+        if any(key is None for key in node.keys):
+            raise _Unsupported('dict unpacking')
+        items = [(self.compile(k), self.compile(v))
+                 for k, v in zip(node.keys, node.values)]
+        return lambda: {k(): v() for k, v in items}
+
+    def _UnaryOp(self, node):
+        op = _UNARY.get(type(node.op))
+        # Jinja2 binds unary minus tighter than **, unlike Python
+        if op is None or (isinstance(node.operand, ast.BinOp) and
+                          isinstance(node.operand.op, ast.Pow)):
+            raise _Unsupported('unary operator')
+        operand = self.compile(node.operand)
+        return lambda: op(operand())
+
+    def _BinOp(self, node):
+        if _is_pipe(node):
+            return self._pipe(node)
+        op = _BINARY.get(type(node.op))
+        # Jinja2 evaluates a ** b ** c from the left, unlike Python
+        if op is None or (isinstance(node.op, ast.Pow) and
+                          isinstance(node.right, ast.BinOp) and
+                          isinstance(node.right.op, ast.Pow)):
+            raise _Unsupported('binary operator')
+        left, right = self.compile(node.left), self.compile(node.right)
+        return lambda: op(left(), right())
+
+    def _pipe(self, node):
+        calls = []
+        while _is_pipe(node):
+            calls.append(_filter_call(node.right))
+            node = node.left
+        # In Jinja2 filters bind tighter than arithmetic, e.g. `2 * x | f`
+        # is `2 * (x | f)`, whereas Python reads `(2 * x) | f`.
+        if isinstance(node, ast.BinOp):
+            raise _Unsupported('arithmetic before a filter')
+        source = self.compile(node)
+        stages = _optimize([self._stage(*call) for call in reversed(calls)])
+
+        def evaluate():
+            value = source()
+            for stage in stages:
+                value = stage(value)
+            return value
+        return evaluate
+
+    def _stage(self, name, args, keywords):
+        func, positional, keyword = self._filter(name)
+        if self._profiler is not None:
+            func = self._profiler.wrap(name, func)
+        if positional is not None and (len(args) > len(positional) or any(
+                kw.arg not in keyword for kw in keywords)):
+            raise _Unsupported('arguments of built-in filter %s' % name)
+        constants = None
+        if all(_is_constant(arg) for arg in args) and \
+                all(_is_constant(kw.value) for kw in keywords):
+            constants = ([], {})
+        self._note_arguments(func, args + [kw.value for kw in keywords])
+        args, kwargs = self._arguments(args, keywords)
+        if constants is not None:
+            constants = ([arg() for arg in args], {k: v() for k, v in kwargs})
+        return _Stage(func, args, kwargs, constants)
+
+    def _note_arguments(self, func, nodes):
+        """Record the pipes (and generators) among the arguments `nodes` of
+        `func`, for the checks of the expression."""
+        for node in nodes:
+            if _is_pipe(node) or isinstance(node, ast.Call):
+                self.arguments.append((func, self.stages(node)))
+
+    def _Call(self, node):
+        if not isinstance(node.func, ast.Name) or \
+                node.func.id not in self._generators:
+            raise _Unsupported('call of a non-generator')
+        func = self._generators[node.func.id]
+        if self._profiler is not None:
+            func = self._profiler.wrap(node.func.id, func, is_filter=False)
+        self._note_arguments(
+            func, node.args + [kw.value for kw in node.keywords])
+        args, kwargs = self._arguments(node.args, node.keywords)
+        return lambda: func(*[arg() for arg in args],
+                            **{k: v() for k, v in kwargs})
+
+
+def _is_constant(node):
+    """Whether `node` is a literal number or string, or arithmetic of them."""
+    if isinstance(node, ast.Constant):
+        return True
+    if isinstance(node, ast.UnaryOp):
+        return _is_constant(node.operand)
+    if isinstance(node, ast.BinOp) and not _is_pipe(node):
+        return _is_constant(node.left) and _is_constant(node.right)
+    return False
+
+
+def _filter_call(node):
+    """The name, arguments and keywords of the filter `node`, e.g. `f(x)`."""
+    if isinstance(node, ast.Name):
+        return node.id, [], []
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name):
+        return node.func.id, node.args, node.keywords
+    raise _Unsupported('not a filter')
@@ -0,0 +1,234 @@
+"""Per-stage profiling of an expression, see `samplitude(..., profile=True)`.
+
+Every generator and filter of the expression is wrapped (when compiling it,
+see `_Samplitude.expression`) so that its calls are timed, and its lazy
+output is wrapped in a `_Counted` iterator, counting and timing the elements
+pulled from it.  The elements in of a filter are those it pulled from its
+input, so e.g. `sample(10)` of an infinite generator reads 10 elements.
+
+The time is that of the stage itself: the time spent in the stages it pulls
+from is attributed to those.  So is the memory allocated (net, in bytes),
+but only if `tracemalloc` is tracing, e.g. with PYTHONTRACEMALLOC=1, as
+tracing slows down everything considerably.
+
+"""
+
+import contextlib
+import functools
+import json
+import time
+import tracemalloc
+
+
+class _Record(object):
+    """The counters of one generator or filter of the expression."""
+
+    def __init__(self, name, is_filter):
+        self.name = name
+        self.calls = 0
+        self.inputs = [] if is_filter else None  # `_Counted`s or lengths
+        self.out = 0
+        self.time = 0.0  # self time
+        self.total = 0.0  # including the stages pulled from
+        self.memory = 0
+
+    @property
+    def elements_in(self):
+        if self.inputs is None:
+            return None
+        return sum(x if isinstance(x, int) else x.count for x in self.inputs)
+
+    def as_dict(self):
+        return {'stage': self.name, 'calls': self.calls,
+                'in': self.elements_in, 'out': self.out,
+                'time': self.time, 'memory': self.memory,
+                'throughput': self.out / self.total
+                if self.calls and self.total else None}
+
+
+class _Counted(object):
+    """The lazy output `wrapped` of a stage, counting the elements taken.
+
+    Other attributes (e.g. `blocked`, `chunksize`, `skip`) are those of
+    `wrapped`, so that the filters treat it the same.
+
+    """
+    def __init__(self, wrapped, record, profiler):
+        self.wrapped = wrapped
+        self.count = 0
+        self._record = record
+        self._profiler = profiler
+        self._iter = wrapped if hasattr(wrapped, '__next__') else None
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.wrapped, name)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        frame = self._profiler._enter()
+        try:
+            if self._iter is None:
+                self._iter = iter(self.wrapped)
+            value = next(self._iter)
+        finally:
+            self._profiler._exit(self._record, frame)
+        self._taken(1)
+        return value
+
+    def blocks(self, *args):
+        blocks = self.wrapped.blocks(*args)
+        while True:
+            frame = self._profiler._enter()
+            try:
+                block = next(blocks, None)
+            finally:
+                self._profiler._exit(self._record, frame)
+            if block is None:
+                return
+            self._taken(len(block))
+            yield block
+
+    def _taken(self, n):
+        self.count += n
+        self._record.out += n
+
+
+class _SizedCounted(_Counted):
+
+    def __len__(self):
+        return len(self.wrapped)
+
+
+def _unwrap(value):
+    return value.wrapped if isinstance(value, _Counted) else value
+
+
+def _is_lazy(value):
+    return hasattr(value, '__next__') or (
+        hasattr(value, '__iter__') and not hasattr(value, '__len__'))
+
+
+def _length(value):
+    try:
+        return len(value)
+    except (TypeError, OverflowError):
+        return None
+
+
+class _Profiler(object):
+    """Collects a `_Record` for every generator and filter wrapped by
+    `wrap`."""
+
+    def __init__(self):
+        self.records = []
+        self.tracing = tracemalloc.is_tracing()
+        self._stack = []  # [start, memory, child time, child memory]
+
+    def wrap(self, name, func, is_filter=True):
+        """`func` counting its calls and elements in the record of `name`."""
+        record = _Record(name, is_filter)
+        self.records.append(record)
+
+        def _inner(*args, **kwargs):
+            return self._call(record, func, args, kwargs)
+        if hasattr(func, 'jinja_pass_arg'):
+            # Jinja2 passes its environment or context before the input
+            def _inner(passed, *args, **kwargs):
+                return self._call(record, functools.partial(func, passed),
+                                  args, kwargs)
+        if not isinstance(func, type):
+            _inner.__dict__.update(getattr(func, '__dict__', {}))
+        _inner.__name__ = name
+        _inner.__wrapped__ = func  # for the signature
+        if isinstance(getattr(func, 'elementwise', None), str):
+            _inner.elementwise = True  # profile the stages one by one, unfused
+        if hasattr(func, 'first_n'):
+            first_n = func.first_n
+            _inner.first_n = lambda *args, **kwargs: self._call(
+                record, first_n, args, kwargs)
+        return _inner
+
+    def _call(self, record, func, args, kwargs):
+        record.calls += 1
+        if record.inputs is not None and args:
+            if isinstance(args[0], _Counted):
+                record.inputs.append(args[0])
+            elif not _is_lazy(args[0]) and _length(args[0]) is not None:
+                record.inputs.append(_length(args[0]))
+        frame = self._enter()
+        try:
+            value = func(*args, **kwargs)
+        finally:
+            self._exit(record, frame)
+        if _is_lazy(value):
+            cls = _SizedCounted if hasattr(value, '__len__') else _Counted
+            return cls(value, record, self)
+        if value is not None:
+            length = None if isinstance(value, str) else _length(value)
+            record.out += 1 if length is None else length
+        return value
+
+    def _memory(self):
+        return tracemalloc.get_traced_memory()[0] if self.tracing else 0
+
+    def _enter(self):
+        frame = [time.perf_counter(), self._memory(), 0.0, 0]
+        self._stack.append(frame)
+        return frame
+
+    def _exit(self, record, frame):
+        """Add the time and memory since `_enter` to `record`, less those of
+        the (nested) frames of the stages pulled from."""
+        self._stack.pop()
+        elapsed = time.perf_counter() - frame[0]
+        allocated = self._memory() - frame[1]
+        record.time += elapsed - frame[2]
+        record.total += elapsed
+        record.memory += allocated - frame[3]
+        if self._stack:
+            self._stack[-1][2] += elapsed
+            self._stack[-1][3] += allocated
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Record the block as the stage `name`, e.g. writing the output."""
+        record = _Record(name, False)
+        self.records.append(record)
+        frame = self._enter()
+        try:
+            yield
+        finally:
+            self._exit(record, frame)
+
+    def report(self, out, as_json=False):
+        """Write the records of the stages called to `out`, as a table or
+        JSON (with `memory` None unless tracing)."""
+        records = [r for r in self.records if r.calls or r.time]
+        if as_json:
+            stats = [r.as_dict() for r in records]
+            for d in stats if not self.tracing else ():
+                d['memory'] = None
+            json.dump(stats, out)
+            out.write('\n')
+            return
+
+        def memory(n):
+            return '%.1f' % (n / 1024) if self.tracing else '-'
+        row = '{:<16}{:>7}{:>11}{:>11}{:>11}{:>11}{:>12}\n'
+        out.write(row.format('stage', 'calls', 'in', 'out', 'time (ms)',
+                             'mem (KiB)', 'elements/s'))
+        for r in records:
+            stats = r.as_dict()
+            out.write(row.format(
+                r.name, r.calls or '-',
+                '-' if stats['in'] is None else stats['in'],
+                r.out if r.calls else '-',
+                '%.1f' % (1000 * r.time), memory(r.memory),
+                '%.3g' % stats['throughput'] if r.calls and r.total else '-'))
+        total = sum(r.time for r in records)
+        out.write(row.format('total', '', '', '', '%.1f' % (1000 * total),
+                             memory(sum(r.memory for r in records)), ''))
@@ -1,85 +1,487 @@
+import collections
+import contextlib
+import contextvars
+import math
+import os
 import random
+import threading
 
-import numpy as np
-import jinja2
-
+from ._alias import _AliasTable
+from ._combinatorics import _Combinatoric
+from ._pipes import _Unsupported, _compile
 from ._utils import _generator
+from ._blocks import _block_filter
+
+ENGINES = ('python', 'numpy')
+
+
+def _triangular(rng, low=0.0, high=1.0, mode=None, size=None):
+    if mode is None:
+        mode = (low + high) / 2.0
+    return rng.triangular(low, mode, high, size)
+
+
+def _vonmises(rng, mu, kappa, size):
+    # random.vonmisesvariate has support [0, 2*pi)
+    return rng.vonmises(mu, kappa, size) % (2 * math.pi)
+
+
+#  The scalar distributions, given a session, and their NumPy block versions,
+#  given a numpy.random.Generator.
+_DISTRIBUTIONS = {
+    'exponential':
+    lambda session: session.random.expovariate,  # one param
+    'uniform':
+    lambda session: session.random.uniform,
+    'gauss':
+    lambda session: session.random.gauss,
+    'normal':
+    lambda session: session.random.normalvariate,
+    'lognormal':
+    lambda session: session.random.lognormvariate,
+    'triangular':
+    lambda session: session.random.triangular,
+    'beta':
+    lambda session: session.random.betavariate,
+    'gamma':
+    lambda session: session.random.gammavariate,
+    'pareto':
+    lambda session: session.random.paretovariate,
+    'vonmises':
+    lambda session: session.random.vonmisesvariate,
+    'weibull':
+    lambda session: session.random.weibullvariate,
+    "poisson":
+    lambda session: session.numpy_random(legacy=True).poisson,
+}
+
+_BLOCK_DISTRIBUTIONS = {
+    'exponential':
+    lambda rng, lambd, size: rng.exponential(1.0 / lambd, size),
+    'uniform':
+    lambda rng, a, b, size: rng.uniform(a, b, size),
+    'gauss':
+    lambda rng, mu, sigma, size: rng.normal(mu, sigma, size),
+    'normal':
+    lambda rng, mu, sigma, size: rng.normal(mu, sigma, size),
+    'lognormal':
+    lambda rng, mu, sigma, size: rng.lognormal(mu, sigma, size),
+    'triangular':
+    _triangular,
+    'beta':
+    lambda rng, alpha, beta, size: rng.beta(alpha, beta, size),
+    'gamma':
+    lambda rng, alpha, beta, size: rng.gamma(alpha, beta, size),
+    'pareto':  # random.paretovariate has support [1, inf)
+    lambda rng, alpha, size: rng.pareto(alpha, size) + 1,
+    'vonmises':
+    _vonmises,
+    'weibull':
+    lambda rng, alpha, beta, size: alpha * rng.weibull(beta, size),
+    'poisson':
+    lambda rng, lam, size: rng.poisson(lam, size),
+}
+
+#  The block distributions drawing exactly one 64-bit number per sample, so
+#  that skipping n samples is advancing the bit generator n steps.
+_ADVANCEABLE = ('uniform', 'triangular')
+
+
+def _jinja_stages(environment, node):
+    """The generators and filters along the pipe of the Jinja2 expression
+    `node`, from the last filter back to the source."""
+    stages = []
+    while node is not None:
+        if hasattr(node, 'name'):
+            #  a name, e.g. of the generator `count`, is looked up among the
+            #  globals first, not to be mistaken for a filter of that name
+            tables = [environment.filters, environment.globals]
+            if node.__class__.__name__ == 'Name':
+                tables.reverse()
+            for table in tables:
+                if node.name in table:
+                    stages.append(table[node.name])
+                    break
+            else:
+                raise ValueError("no filter named '%s'" % node.name)
+        node = node.node if hasattr(node, 'node') else None
+    return stages
+
+
+def _jinja_arguments(environment, node):
+    """The pairs `(func, stages)` of the pipes (and generators) given as
+    arguments to a generator or filter `func` in the Jinja2 expression
+    `node`, see `_pipes._Pipeline`."""
+    from jinja2 import nodes
+    arguments = []
+    for call in node.find_all((nodes.Filter, nodes.Call)):
+        if isinstance(call, nodes.Filter):
+            func = environment.filters.get(call.name)
+        else:
+            func = environment.globals.get(getattr(call.node, 'name', None))
+        for arg in call.args + [kw.value for kw in call.kwargs]:
+            if isinstance(arg, (nodes.Filter, nodes.Call)):
+                arguments.append((func, _jinja_stages(environment, arg)))
+    return arguments
+
+
+class _Session(object):
+    """The random state and settings of one evaluation of an expression.
+
+    Every call to `samplitude` gets its own session, so concurrent calls
+    (e.g. from threads) do not share random state.  If `plot_out` is given,
+    the plotting filters save their plots to this path.  A session of a
+    client of the server (see `_server`) has the working directory `cwd`
+    and the standard input `stdin` of the client.
+
+    """
+    def __init__(self, seed=None, engine='python', chunksize=None,
+                 plot_out=None, cwd=None, stdin=None):
+        if engine not in ENGINES:
+            raise ValueError('unknown engine %s, expected one of %s' %
+                             (engine, ', '.join(ENGINES)))
+        self.seed = seed
+        self.engine = engine
+        self.chunksize = chunksize
+        self.plot_out = plot_out
+        self.cwd = cwd
+        self.stdin = stdin
+        self.random = random.Random(seed)
+        self._nprandom = None
+        self._nplegacy = None
+
+    def path(self, fname):
+        """The file name `fname`, relative to `cwd` if given."""
+        if self.cwd is None:
+            return fname
+        return os.path.join(self.cwd, fname)
+
+    def numpy_random(self, legacy=False):
+        """The seeded `numpy.random.Generator`, created on first use.
+
+        With `legacy=True`, a seeded `numpy.random.RandomState` is returned
+        instead, which is what `poisson` and the scipy distributions use.
+
+        """
+        import numpy as np
+        if legacy:
+            if self._nplegacy is None:
+                self._nplegacy = np.random.RandomState(self.seed)
+            return self._nplegacy
+        if self._nprandom is None:
+            self._nprandom = np.random.default_rng(self.seed)
+        return self._nprandom
 
 
 class _Samplitude:
     def __init__(self, seed=None, filters=None):
-        self.__random = None
-        self.jenv = jinja2.Environment()
-        self.set_seed(seed)
+        self.globals = {}
+        self.filters = {}
+        self.__jenv = None
+        self.__jenv_lock = threading.Lock()
+        self.__default_session = _Session(seed)
+        self.__session = contextvars.ContextVar('samplitude_session')
+        self.cache_size = 128
+        self._templates = collections.OrderedDict()
+        self._templates_lock = threading.Lock()
+        self.__native = True
+        self.__add_the_ugly_stuff()
+
+    @property
+    def native(self):
+        """Whether to compile expressions natively when possible (default),
+        or always with Jinja2."""
+        return self.__native
+
+    @native.setter
+    def native(self, native):
+        self.__native = native
+        self.clear_cache()
+
+    @property
+    def jenv(self):
+        """The Jinja2 environment, created (and jinja2 imported) on first use."""
+        with self.__jenv_lock:
+            if self.__jenv is None:
+                import jinja2
+                # no constant folding, which would evaluate e.g. `'HT' |
+                # choice` once at compile time and cache the "random" result
+                jenv = jinja2.Environment(optimized=False)
+                jenv.globals.update(self.globals)
+                jenv.filters.update(self.filters)
+                self.__jenv = jenv
+        return self.__jenv
+
+    def __register(self, table, name, func):
+        getattr(self, table)[name] = func
+        if self.__jenv is not None:
+            getattr(self.__jenv, table)[name] = func
+
+    def session(self):
+        """The session bound in the current context, or the default session."""
+        return self.__session.get(self.__default_session)
+
+    @contextlib.contextmanager
+    def bind(self, session):
+        """Evaluate expressions within `session` in the current context."""
+        token = self.__session.set(session)
+        try:
+            yield session
+        finally:
+            self.__session.reset(token)
 
     def set_seed(self, seed):
-        if seed is None:
-            self.__random = random.Random()
+        """Reseed the default session, used outside of `bind`."""
+        default = self.__default_session
+        self.__default_session = _Session(seed, default.engine, default.chunksize)
+
+    def set_engine(self, engine, chunksize=None):
+        """Select the sampling engine of the default session.
+
+        The `numpy` engine draws the built-in distributions in blocks of
+        `chunksize` samples from a `numpy.random.Generator`.
+
+        """
+        default = self.__default_session
+        self.__default_session = _Session(default.seed, engine, chunksize)
+
+    def expression(self, source, check=None, profiler=None):
+        """Return the compiled expression for the template `source`.
+
+        The template `{{ expr }}` is compiled by the native compiler (see
+        `_pipes`) to a chain of the registered generators and filters, or if
+        it cannot handle `expr`, parsed and compiled by Jinja2 to a function
+        returning the value of `expr`.  The generators and filters along the
+        pipe, from the last filter back to the source, and those of the
+        pipes given as arguments (see `_pipes._Pipeline`), are first passed
+        to `check(stages, arguments)`, which may raise.  The `cache_size`
+        most recently used expressions are cached by `source` with only the
+        surrounding whitespace stripped, until a generator or filter is
+        (re-)registered.
+
+        With a `profiler` (see `_profile`), the expression calls the
+        generators and filters wrapped by it, and is not cached.
+
+        """
+        source = source.strip()
+        with self._templates_lock:
+            expression = self._templates.get(source)
+            if expression is not None and profiler is None:
+                self._templates.move_to_end(source)
+                return expression
+
+        expression = self.__compile_native(source, profiler)
+        if expression is not None:
+            stages, arguments = expression.stages, expression.arguments
         else:
-            self.__random = random.Random(seed)
-            np.random.seed(seed)
+            jenv = self.jenv if profiler is None else \
+                self.__profiled_jenv(profiler)
+            ast = jenv.parse(source)
+            node = ast.body[0].nodes[0]
+            stages = _jinja_stages(jenv, node)
+            arguments = _jinja_arguments(jenv, node)
+        if check is not None:
+            check(stages, arguments)
+        if expression is None:
+            expression = self.__compile_expression(jenv, ast)
+        if profiler is not None:
+            return expression
 
-        self.__add_the_ugly_stuff()
+        with self._templates_lock:
+            self._templates[source] = expression
+            while len(self._templates) > max(self.cache_size, 0):
+                self._templates.popitem(last=False)
+        return expression
+
+    def __compile_native(self, source, profiler=None):
+        if not self.native or not (source.startswith('{{') and
+                                   source.endswith('}}')):
+            return None
+        try:
+            return _compile(source[2:-2], self.globals, self.filters, profiler)
+        except _Unsupported:
+            return None
+
+    def __profiled_jenv(self, profiler):
+        """An overlay of the Jinja2 environment with the generators and
+        filters wrapped by `profiler`, including those of Jinja2, e.g.
+        `range` and `list`, as with the native compiler."""
+        jenv = self.jenv.overlay()
+
+        def wrap(table, is_filter):
+            return {name: profiler.wrap(name, func, is_filter)
+                    if callable(func) else func
+                    for name, func in table.items()}
+        jenv.globals = wrap(self.jenv.globals, False)
+        jenv.filters = wrap(self.jenv.filters, True)
+        return jenv
+
+    def __compile_expression(self, jenv, ast):
+        from jinja2 import nodes
+        from jinja2.environment import TemplateExpression
+        # assigned rather than output, which Jinja2 would render at compile
+        # time if constant, e.g. `'HT' | choice`
+        result = nodes.Name('result', 'store', lineno=1)
+        body = [nodes.Assign(result, ast.body[0].nodes[0], lineno=1)]
+        template = jenv.from_string(nodes.Template(body, lineno=1))
+        return TemplateExpression(template, undefined_to_none=False)
+
+    def clear_cache(self):
+        with self._templates_lock:
+            self._templates.clear()
 
     def add_filters(self, filters):
+        changed = False
         for fname, f in filters.items():
-            self.jenv.filters[fname] = f
+            if self.filters.get(fname) is not f:
+                self.__register('filters', fname, f)
+                changed = True
+        if changed:
+            self.clear_cache()
 
-    def generator(self, name, func=None, infinite=False):
-        if func is not None:
+    def generator(self, name, func=None, infinite=False, random=False):
+        """Register a generator.
+
+        Random generators (`random=True`) may be sampled in parallel with
+        independent streams, see `samplitude(..., workers=N)`.
+
+        """
+        def register(func):
             func.is_infinite = infinite
-            self.jenv.globals.update({name: func})
+            if random:
+                func.is_random = True
+            self.__register('globals', name, func)
+            self.clear_cache()
+
+        if func is not None:
+            register(func)
             return
 
         def decorator(func):
-            func.is_infinite = infinite
-            self.jenv.globals.update({name: func})
+            register(func)
             return lambda x: x
         return decorator
 
-    def filter(self, name, func=None, limiter=False):
-        if func is not None:
+    def filter(self, name, func=None, limiter=False, blocks=None,
+               elementwise=None, prefix=False, first_n=None):
+        """Register a filter.
+
+        A filter may opt in to NumPy blocks by giving `blocks`, a function
+        taking an iterator over array blocks and the filter arguments, and
+        yielding array blocks; see `_blocks._block_filter`.
+
+        The rest describe the filter to the optimizer (see `_optimize`):
+        `elementwise` if it maps every element to one element (consuming
+        stream arguments in step), which may be a template such as
+        `'{x} * {s}'` giving the element for constant arguments; `prefix` if
+        it gives the first `n` elements of its input, like `head(n)`; and
+        `first_n(gen, n, *args)`, giving the first `n` elements of the
+        output of the filter without computing the rest.
+
+        """
+        def register(func):
+            if blocks is not None:
+                func = _block_filter(func, blocks)
             func.is_limiter = limiter
-            self.jenv.filters[name] = func
+            if elementwise is not None:
+                func.elementwise = elementwise
+            if prefix:
+                func.is_prefix = True
+            if first_n is not None:
+                func.first_n = first_n
+            self.__register('filters', name, func)
+            self.clear_cache()
+
+        if func is not None:
+            register(func)
             return
 
         def decorator(func):
-            func.is_limiter = limiter
-            self.jenv.filters[name] = func
+            register(func)
             return lambda x: x
         return decorator
 
     def _shuffle(self, dist):
         dist = list(dist)
-        self.__random.shuffle(dist)
+        self.session().random.shuffle(dist)
         return dist
 
+    def _choice(self, seq, weights=None):
+        if hasattr(seq, 'random_access'):
+            seq = seq.random_access()  # e.g. the indexed lines of a file
+        elif not hasattr(seq, '__getitem__'):
+            seq = list(seq)  # e.g. a stream read from a file
+        if weights is not None:
+            return self._weighted_choice(seq, weights)
+        if isinstance(seq, _Combinatoric):
+            # may be too large for len, which random.choice uses
+            rng = self.session().random
+            return _generator(lambda: seq[rng.randrange(seq.size)])()
+        return _generator(self.session().random.choice)(seq)
+
+    def _weighted_choice(self, seq, weights):
+        if isinstance(seq, dict):
+            seq = list(seq)
+        table = _AliasTable(weights)
+        if table.n != len(seq):
+            raise ValueError('got %d weights for %d elements' %
+                             (table.n, len(seq)))
+        session = self.session()
+        rng = session.random
+        block = None
+        if session.engine == 'numpy':
+            import numpy as np
+            try:
+                values = np.asarray(seq)
+            except ValueError:  # e.g. tuples of different lengths
+                values = np.empty(0, dtype=object)
+            if values.dtype.kind not in 'biuf' or values.ndim != 1:
+                # e.g. tuples, which must be drawn as they are, not as rows
+                values = np.empty(len(seq), dtype=object)
+                for i, value in enumerate(seq):
+                    values[i] = value
+            nprng = session.numpy_random()
+            block = lambda size: values[table.draw_block(nprng, size)]
+        return _generator(lambda: seq[table.draw(rng)], block,
+                          session.chunksize)()
+
+    def _wchoice(self, seq, weights=None):
+        if weights is None:
+            if not isinstance(seq, dict):
+                raise ValueError('wchoice needs weights, or a dict of weights')
+            seq, weights = list(seq.keys()), list(seq.values())
+        return self._choice(seq, weights)
+
+    def __distribution(self, name):
+        scalar = _DISTRIBUTIONS[name]
+        block = _BLOCK_DISTRIBUTIONS.get(name)
+
+        def _inner(*args):
+            session = self.session()
+            draw = advance = None
+            if block is not None and session.engine == 'numpy':
+                rng = session.numpy_random()
+                draw = lambda *args, **kwargs: block(rng, *args, **kwargs)
+                if name in _ADVANCEABLE:
+                    advance = rng.bit_generator.advance
+            return _generator(scalar(session), draw, session.chunksize,
+                              advance)(*args)
+        return _inner
+
     def __add_the_ugly_stuff(self):
-        self.jenv.globals.update({
-            'exponential':
-            _generator(self.__random.expovariate),  # one param
-            'uniform':
-            _generator(self.__random.uniform),
-            'gauss':
-            _generator(self.__random.gauss),
-            'normal':
-            _generator(self.__random.normalvariate),
-            'lognormal':
-            _generator(self.__random.lognormvariate),
-            'triangular':
-            _generator(self.__random.triangular),
-            'beta':
-            _generator(self.__random.betavariate),
-            'gamma':
-            _generator(self.__random.gammavariate),
-            'pareto':
-            _generator(self.__random.paretovariate),
-            'vonmises':
-            _generator(self.__random.vonmisesvariate),
-            'weibull':
-            _generator(self.__random.weibullvariate),
-            "poisson":
-            _generator(np.random.poisson),
-            })
-        self.jenv.filters['choice'] = _generator(self.__random.choice)
-        self.jenv.filters['shuffle'] = self._shuffle
+        for name in _DISTRIBUTIONS:
+            self.generator(name, self.__distribution(name), infinite=True,
+                           random=True)
+
+        def choice(seq, weights=None):
+            return self._choice(seq, weights)
+        choice.is_infinite = True
+        choice.is_random = True
+        self.filter('choice', choice)
+
+        def wchoice(seq, weights=None):
+            return self._wchoice(seq, weights)
+        wchoice.is_infinite = True
+        wchoice.is_random = True
+        self.filter('wchoice', wchoice)
+        self.filter('shuffle', lambda dist: self._shuffle(dist))
@@ -0,0 +1,149 @@
+"""A server evaluating expressions for clients on a Unix socket.
+
+`samplitude --serve` imports Jinja2 and NumPy once, and keeps them (and
+whatever else the expressions import) and the compiled expressions loaded,
+evaluating the expressions of its clients in a thread each.  A client,
+`samplitude --socket PATH "expr"` (or with SAMPLITUDE_SOCKET=PATH), sends a
+line of JSON with the expression and its settings, along with its standard
+input, output and error as file descriptors (SCM_RIGHTS), which the server
+reads from and writes to directly.  The reply is a line of JSON with the
+exit status of the client (see `_client`).
+
+Every request is evaluated in a session of its own (see `_Session`), with
+its own random state, and with the working directory of the client for
+relative file names.
+
+"""
+
+import array
+import json
+import os
+import socket
+import socketserver
+import sys
+import tempfile
+import traceback
+
+from ._client import _STREAMS, _read_line
+
+
+def _default_path():
+    return os.getenv('SAMPLITUDE_SOCKET') or os.path.join(
+        tempfile.gettempdir(), 'samplitude-%d.sock' % os.getuid())
+
+
+def _receive(sock):
+    """The request of a client and the file descriptors sent with it."""
+    fds = array.array('i')
+    data, ancillary, _, _ = sock.recvmsg(
+        2**16, socket.CMSG_SPACE(_STREAMS * fds.itemsize))
+    for level, kind, payload in ancillary:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(payload[:len(payload) - len(payload) % fds.itemsize])
+    try:
+        return _read_line(sock, data), list(fds)
+    except (ConnectionError, ValueError):
+        for fd in fds:
+            os.close(fd)
+        raise
+
+
+class _Handler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        from . import _Session, _evaluate
+        try:
+            request, fds = _receive(self.request)
+        except (ConnectionError, ValueError):
+            return
+        if len(fds) != _STREAMS:
+            for fd in fds:
+                os.close(fd)
+            return self._reply(2)
+        stdin = os.fdopen(fds[0], 'r')
+        stdout = os.fdopen(fds[1], 'w')
+        stderr = os.fdopen(fds[2], 'w', buffering=1)
+        status = 0
+        try:
+            if (request.get('workers') or 1) > 1:
+                # forking this process, with its threads, is not safe
+                raise ValueError('the server does not sample with workers, '
+                                 'run samplitude without a server for that')
+            session = _Session(request.get('seed'),
+                               request.get('engine') or 'python',
+                               request.get('chunksize'),
+                               request.get('plot_out'),
+                               cwd=request.get('cwd'), stdin=stdin)
+            res = _evaluate(request['cmd'], session, out=stdout,
+                            profile=request.get('profile', False),
+                            err=stderr)
+            if res:
+                print(res, file=stdout)
+            stdout.flush()
+        except BrokenPipeError:
+            status = 1  # e.g. the client is piped into head
+        except Exception:
+            # as the traceback of an uncaught exception in the client
+            stderr.write(traceback.format_exc())
+            status = 1
+        finally:
+            for f in (stdin, stdout, stderr):
+                try:
+                    f.close()
+                except OSError:
+                    pass
+        self._reply(status)
+
+    def _reply(self, status):
+        try:
+            self.request.sendall(
+                json.dumps({'status': status}).encode() + b'\n')
+        except OSError:
+            pass  # the client is gone
+
+
+class _Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def _is_listening(path):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+        except OSError:
+            return False
+    return True
+
+
+def _preload():
+    """Import Jinja2, and NumPy if installed, before the first request."""
+    from . import s8e
+    s8e.jenv
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        pass
+
+
+def serve(path=None, log=sys.stderr):
+    """Serve the clients on the Unix socket `path` until interrupted."""
+    path = path or _default_path()
+    if os.path.exists(path):
+        if _is_listening(path):
+            raise OSError('a server is already listening on %s' % path)
+        os.unlink(path)  # left behind by a server that was killed
+    _preload()
+    umask = os.umask(0o177)  # only the user may connect
+    try:
+        server = _Server(path, _Handler)
+    finally:
+        os.umask(umask)
+    log.write('samplitude: listening on %s\n' % path)
+    log.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(path)
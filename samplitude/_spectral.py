@@ -0,0 +1,79 @@
+"""Spectra of streams, computed segment by segment (Welch's method, STFT)."""
+
+_WINDOWS = ('hann', 'hamming', 'blackman', 'bartlett', 'boxcar')
+
+
+def _window(name, n):
+    """The periodic window `name` of length `n` (as used for spectra)."""
+    import numpy as np
+    if name is None or name == 'boxcar':
+        return np.ones(n)
+    if name not in _WINDOWS:
+        raise ValueError('unknown window %r, expected one of %s' %
+                         (name, ', '.join(_WINDOWS)))
+    func = {'hann': np.hanning, 'hamming': np.hamming,
+            'blackman': np.blackman, 'bartlett': np.bartlett}[name]
+    return func(n + 1)[:-1]
+
+
+class _Segments(object):
+    """Spectra of the overlapping segments of a stream.
+
+    The stream is added a block (a NumPy array) at a time; every `segment`
+    consecutive samples, starting every `segment - overlap` samples, are
+    multiplied by the window and transformed with a real FFT, all complete
+    segments of a block at once.  Only the incomplete last segment is kept
+    between blocks.  The spectra are either averaged into a power spectral
+    density (Welch's method, with `average`) or all kept (an STFT).
+
+    """
+    def __init__(self, segment, window='hann', overlap=None, average=True):
+        import numpy as np
+        if overlap is None:
+            overlap = segment // 2
+        if not 0 <= overlap < segment:
+            raise ValueError('overlap must be in [0, segment)')
+        self.segment = segment
+        self.step = segment - overlap
+        self.window = _window(window, segment)
+        self.average = average
+        self.n = 0  # the number of segments
+        self._power = np.zeros(segment // 2 + 1)
+        self._spectra = []
+        self._rest = np.zeros(0)
+
+    def update(self, block):
+        import numpy as np
+        from numpy.lib.stride_tricks import as_strided
+        buf = np.concatenate((self._rest, block))
+        if len(buf) < self.segment:
+            self._rest = buf
+            return
+        count = (len(buf) - self.segment) // self.step + 1
+        size = buf.strides[0]
+        frames = as_strided(buf, shape=(count, self.segment),
+                            strides=(size * self.step, size), writeable=False)
+        spectra = np.fft.rfft(frames * self.window, axis=-1)
+        self.n += len(frames)
+        if self.average:
+            self._power += (spectra.real**2 + spectra.imag**2).sum(axis=0)
+        else:
+            self._spectra.append(spectra)
+        self._rest = buf[len(frames) * self.step:]
+
+    def psd(self):
+        """The one-sided power spectral density (for sample rate 1)."""
+        import numpy as np
+        if not self.n:
+            return np.zeros(0)
+        psd = self._power / (self.n * (self.window**2).sum())
+        last = None if self.segment % 2 else -1  # the Nyquist bin
+        psd[1:last] *= 2
+        return psd
+
+    def stft(self):
+        """The spectra of the segments, one row per segment."""
+        import numpy as np
+        if not self._spectra:
+            return np.zeros((0, self.segment // 2 + 1), dtype=complex)
+        return np.concatenate(self._spectra)
@@ -0,0 +1,237 @@
+import hashlib
+import heapq
+import math
+import random
+
+
+class _Moments(object):
+    """Count, mean, variance, min and max of a stream, in one pass.
+
+    Elements are added one at a time with Welford's update, or a block at a
+    time (e.g. a NumPy array) by merging the block's moments (Chan et al.),
+    so two `_Moments` of separate streams can be merged as well.
+
+    """
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+
+    def update(self, elements):
+        n, mean, m2 = self.n, self.mean, self.m2
+        lo, hi = self.min, self.max
+        for x in elements:
+            n += 1
+            delta = x - mean
+            mean += delta / n
+            m2 += delta * (x - mean)
+            if lo is None or x < lo:
+                lo = x
+            if hi is None or x > hi:
+                hi = x
+        self.n, self.mean, self.m2 = n, mean, m2
+        self.min, self.max = lo, hi
+
+    def update_block(self, block):
+        if not len(block):
+            return
+        other = _Moments()
+        other.n = len(block)
+        other.mean = float(block.mean())
+        other.m2 = float(((block - other.mean)**2).sum())
+        other.min = block.min().item()
+        other.max = block.max().item()
+        self.merge(other)
+
+    def merge(self, other):
+        if not other.n:
+            return
+        if not self.n:
+            self.n, self.mean, self.m2 = other.n, other.mean, other.m2
+            self.min, self.max = other.min, other.max
+            return
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        self.mean += delta * other.n / n
+        self.m2 += other.m2 + delta * delta * self.n * other.n / n
+        self.n = n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def var(self, ddof=0):
+        if self.n - ddof <= 0:
+            return float('nan')
+        return self.m2 / (self.n - ddof)
+
+
+class _KLL(object):
+    """Quantile sketch of a stream (Karnin, Lang and Liberty, 2016).
+
+    Keeps O(k) elements in levels, where an element at level h stands for 2**h
+    elements of the stream.  A full level is sorted and every other element
+    (from a random offset) is promoted to the next level.  The sketch is exact
+    until more than `k` elements have been added; thereafter the rank error
+    is roughly 1.7/k with high probability.  Sketches with the same `k` can be
+    merged.
+
+    """
+    def __init__(self, k=200, seed=0):
+        self.k = k
+        self.n = 0
+        self.levels = [[]]
+        self._random = random.Random(seed)
+
+    def _capacity(self, h):
+        depth = len(self.levels) - h - 1
+        return max(int(math.ceil(self.k * (2.0 / 3)**depth)), 2)
+
+    def _size(self):
+        return sum(len(level) for level in self.levels)
+
+    def _max_size(self):
+        return sum(self._capacity(h) for h in range(len(self.levels)))
+
+    def _compress(self):
+        while self._size() > self._max_size():
+            for h, level in enumerate(self.levels):
+                if len(level) >= self._capacity(h):
+                    break
+            if h + 1 == len(self.levels):
+                self.levels.append([])
+            level.sort()
+            keep = [level.pop()] if len(level) % 2 else []
+            offset = self._random.randint(0, 1)
+            self.levels[h + 1].extend(level[offset::2])
+            self.levels[h] = keep
+
+    def update(self, elements):
+        elements = list(elements)
+        self.n += len(elements)
+        self.levels[0].extend(elements)
+        self._compress()
+
+    def merge(self, other):
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+        for h, level in enumerate(other.levels):
+            self.levels[h].extend(level)
+        self.n += other.n
+        self._compress()
+
+    def quantiles(self, qs):
+        """The elements of (approximately) rank `q * n`, for each `q` in `qs`.
+
+        Uses the inverted CDF, i.e. the smallest element `x` with at least a
+        fraction `q` of the stream less than or equal to `x`.
+
+        """
+        weighted = sorted((x, 2**h)
+                          for h, level in enumerate(self.levels)
+                          for x in level)
+        result = []
+        for q in qs:
+            if not 0 <= q <= 1:
+                raise ValueError('quantile %s not in [0, 1]' % q)
+            if not weighted:
+                result.append(float('nan'))
+                continue
+            target, rank = q * self.n, 0
+            for x, w in weighted:
+                rank += w
+                if rank >= target:
+                    break
+            result.append(x)
+        return result
+
+
+class _MisraGries(object):
+    """The frequent elements of a stream (Misra and Gries, 1982).
+
+    At most `capacity` counters are kept.  Whenever there are more, the
+    `capacity + 1`-th largest count is subtracted from every counter and the
+    non-positive counters are dropped, so every count is an underestimate by
+    at most n / (capacity + 1), and exact if there are at most `capacity`
+    distinct elements.  Counts are added in batches, e.g. of a `Counter` of
+    a chunk of the stream.
+
+    """
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.n = 0
+        self.counts = {}
+
+    def update(self, counts):
+        for x, c in counts:
+            self.counts[x] = self.counts.get(x, 0) + c
+            self.n += c
+        if len(self.counts) > self.capacity:
+            cut = heapq.nlargest(self.capacity + 1, self.counts.values())[-1]
+            self.counts = {x: c - cut for x, c in self.counts.items()
+                           if c > cut}
+
+    def top(self, k):
+        """The (at most) `k` most frequent elements with their counts."""
+        return heapq.nlargest(k, self.counts.items(), key=lambda xc: xc[1])
+
+
+def _hash64(values):
+    """64-bit hashes of `values` (a NumPy array or a list), which unlike
+    `hash` are the same in every process.  Equal numbers have equal hashes."""
+    import numpy as np
+    try:
+        arr = np.asarray(values)
+    except ValueError:  # e.g. tuples of different lengths
+        arr = np.empty(0, dtype=object)
+    if arr.dtype.kind in 'biuf' and arr.ndim == 1:
+        bits = (arr.astype(np.float64) + 0.0).view(np.uint64)  # -0.0 is 0.0
+    else:
+        bits = np.fromiter(
+            (int.from_bytes(hashlib.blake2b(repr(x).encode(),
+                                            digest_size=8).digest(), 'little')
+             for x in values), dtype=np.uint64, count=len(values))
+    # splitmix64 finalizer, to spread the bits of the numbers
+    bits = bits ^ (bits >> np.uint64(30))
+    bits = bits * np.uint64(0xbf58476d1ce4e5b9)
+    bits = bits ^ (bits >> np.uint64(27))
+    bits = bits * np.uint64(0x94d049bb133111eb)
+    return bits ^ (bits >> np.uint64(31))
+
+
+class _HyperLogLog(object):
+    """Estimate of the number of distinct elements of a stream (Flajolet et
+    al., 2007), using 2**p registers, with a relative error of about
+    1.04 / sqrt(2**p), i.e. 0.8% for the default p = 14."""
+
+    def __init__(self, p=14):
+        import numpy as np
+        self.p = p
+        self.registers = np.zeros(2**p, dtype=np.uint8)
+
+    def update(self, values):
+        import numpy as np
+        if not len(values):
+            return
+        h = _hash64(values)
+        idx = (h >> np.uint64(64 - self.p)).astype(np.int64)
+        rest = h & np.uint64((1 << (64 - self.p)) - 1)
+        # the position of the leftmost 1-bit of the remaining 64 - p bits
+        _, bit_length = np.frexp(rest.astype(np.float64))
+        rank = (64 - self.p + 1 - bit_length).astype(np.uint8)
+        np.maximum.at(self.registers, idx, rank)
+
+    def merge(self, other):
+        import numpy as np
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def estimate(self):
+        import numpy as np
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        harmonic = np.ldexp(1.0, -self.registers.astype(int)).sum()
+        estimate = alpha * m * m / harmonic
+        zeros = int((self.registers == 0).sum())
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)  # linear counting
+        return int(round(estimate))
@@ -1,3 +1,8 @@
+import builtins
+import sys
+import time
+
+
 class _set(frozenset):
     # for nicer repr only
     def __repr__(self):
@@ -5,9 +10,62 @@ class _set(frozenset):
         return '{%s}' % content
 
 
-def _generator(func):
-    def _inner(*args):
+def _generator(func, block=None, chunksize=None, advance=None):
+    """Infinite generator calling `func` for every element.
+
+    If `block` is given, it is called as `block(*args, size=k)` and should
+    return an array of `k` samples; the generator then draws in blocks, and
+    skips ahead with `advance(n)` if given (see `_BlockGenerator`).
+
+    """
+    def _scalar(*args):
         while True:
             yield (func(*args))
+
+    def _inner(*args):
+        if block is None:
+            return _scalar(*args)
+        from ._blocks import _BlockGenerator
+        return _BlockGenerator(lambda k: block(*args, size=k),
+                               chunksize=chunksize, advance=advance)
     _inner.is_infinite = True
+    _inner.is_random = True
     return _inner
+
+
+class _ImportTimer(object):
+    """Records the time spent on (outermost) imports between start and stop.
+
+    Used for `--import-time`, to verify that heavy libraries such as numpy,
+    jinja2 and matplotlib are only imported when an expression needs them.
+
+    """
+    def __init__(self):
+        self.times = []
+        self._depth = 0
+
+    def start(self):
+        self._import = builtins.__import__
+        builtins.__import__ = self._timed_import
+
+    def stop(self):
+        builtins.__import__ = self._import
+
+    def _timed_import(self, name, *args, **kwargs):
+        level = kwargs.get('level', args[3] if len(args) > 3 else 0)
+        if self._depth > 0 or level > 0 or name in sys.modules:
+            return self._import(name, *args, **kwargs)
+        self._depth += 1
+        start = time.perf_counter()
+        try:
+            return self._import(name, *args, **kwargs)
+        finally:
+            self._depth -= 1
+            self.times.append((name, time.perf_counter() - start))
+
+    def report(self, out, initial=()):
+        times = list(initial) + self.times
+        out.write('import time (ms)\n')
+        for name, seconds in times:
+            out.write('{:10.1f}  {}\n'.format(1000 * seconds, name))
+        out.write('{:10.1f}  total\n'.format(1000 * sum(t for _, t in times)))
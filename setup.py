@@ -10,11 +10,11 @@ __webpage = __source
 __description = "Samplitude (s8e) is a statistical distributions command line tool"
 
 requirements = {
-  'minimum': ['numpy>=1.11', 'Jinja2'],
-  'csv': ['numpy>=1.11', 'Jinja2', 'pandas'],
-  'sci': ['numpy>=1.11', 'Jinja2', 'scipy'],
-  'csv_sci': ['numpy>=1.11', 'Jinja2', 'pandas', 'scipy'],
-  'plot': ['numpy>=1.11', 'Jinja2', 'matplotlib']
+  'minimum': ['numpy>=1.17', 'Jinja2'],
+  'csv': ['numpy>=1.17', 'Jinja2', 'pandas'],
+  'sci': ['numpy>=1.17', 'Jinja2', 'scipy'],
+  'csv_sci': ['numpy>=1.17', 'Jinja2', 'pandas', 'scipy'],
+  'plot': ['numpy>=1.17', 'Jinja2', 'matplotlib']
 }
 requirements['complete'] = sorted(set(sum(requirements.values(), [])))
 
@@ -0,0 +1,152 @@
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+
+def _run(*args, **kwargs):
+    cmd = [sys.executable, '-m', 'samplitude'] + list(args)
+    return subprocess.run(cmd, capture_output=True, text=True, **kwargs)
+
+
+class TestSamplitudeCli(unittest.TestCase):
+
+    def test_cli(self):
+        proc = _run('range(10) | sum')
+        self.assertEqual(0, proc.returncode)
+        self.assertEqual('45\n', proc.stdout)
+
+    def test_cli_seed(self):
+        proc = _run('uniform(0, 5) | round(2) | sample(2) | list', '1729')
+        self.assertEqual('[4.98, 4.42]\n', proc.stdout)
+
+    def test_cli_streaming(self):
+        cmd = [sys.executable, '-m', 'samplitude', 'count() | sample(10**12) | cli']
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+        self.assertEqual('0\n', proc.stdout.readline())
+        self.assertEqual('1\n', proc.stdout.readline())
+        proc.stdout.close()
+        self.assertNotEqual(0, proc.wait(timeout=10))
+
+    def test_stdin_streaming(self):
+        # the pipe stays open, so stdin() must not wait for all of the input
+        cmd = [sys.executable, '-m', 'samplitude', 'stdin() | head(2) | cli']
+        with subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                              stdout=subprocess.PIPE, text=True) as proc:
+            proc.stdin.write(' a\nb \nc\n')
+            proc.stdin.flush()
+            self.assertEqual(0, proc.wait(timeout=30))
+            self.assertEqual('a\nb\n', proc.stdout.read())
+            proc.stdin.close()
+
+    def test_bench(self):
+        import json
+        proc = _run('bench', '--sizes', '100,200', '--repeat', '1', '--json',
+                    'normal', 'pairs', 'round', 'cli', 'npy')
+        results = json.loads(proc.stdout)['results']
+        self.assertEqual(10, len(results))
+        for result in results:
+            self.assertNotIn('error', result)
+            self.assertGreater(result['samples_per_sec'], 0)
+            self.assertGreater(result['peak_bytes'], 0)
+
+    def test_lazy_imports(self):
+        heavy = "('numpy', 'jinja2', 'matplotlib', 'scipy', 'pandas')"
+        proc = subprocess.run(
+            [sys.executable, '-c',
+             'import sys, samplitude;'
+             'print([m for m in %s if m in sys.modules])' % heavy],
+            capture_output=True, text=True)
+        self.assertEqual('[]\n', proc.stdout)
+
+    def test_plot_out(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'hist.png')
+            proc = _run('--plot-out', path,
+                        'normal(0, 1) | sample(1000) | list | hist | len')
+            self.assertEqual('1000\n', proc.stdout)
+            with open(path, 'rb') as f:
+                self.assertEqual(b'\x89PNG', f.read(4))
+            proc = subprocess.run(
+                [sys.executable, '-c',
+                 'import sys, samplitude;'
+                 'samplitude.samplitude("count() | sample(100) | pairs |'
+                 ' heat(path=\'%s\')");'
+                 'print("matplotlib.pyplot" in sys.modules)'
+                 % os.path.join(tmp, 'heat.pdf')],
+                capture_output=True, text=True)
+            self.assertEqual('False\n', proc.stdout)
+            self.assertTrue(os.path.isfile(os.path.join(tmp, 'heat.pdf')))
+
+    def test_import_time(self):
+        proc = _run('--import-time', 'range(10) | sum')
+        self.assertEqual('45\n', proc.stdout)
+        self.assertIn('samplitude', proc.stderr)
+        self.assertNotIn('jinja2', proc.stderr)
+        self.assertNotIn('numpy', proc.stderr)
+        self.assertNotIn('matplotlib', proc.stderr)
+        proc = _run('--import-time', "range(3) | map('string') | join")
+        self.assertEqual('012\n', proc.stdout)
+        self.assertIn('jinja2', proc.stderr)
+
+    def test_profile(self):
+        proc = _run('--profile', 'count() | sample(10) | shift(1) | sum')
+        self.assertEqual('55\n', proc.stdout)
+        rows = {row.split()[0]: row.split()[1:4]
+                for row in proc.stderr.splitlines()[1:]}
+        self.assertEqual(['1', '-', '10'], rows['count'])
+        self.assertEqual(['1', '10', '10'], rows['sample'])
+        self.assertEqual(['1', '10', '1'], rows['sum'])
+        proc = _run('--profile-json', "range(3) | map('string') | join")
+        self.assertEqual('012\n', proc.stdout)
+        stages = {s['stage']: s for s in json.loads(proc.stderr)}
+        self.assertEqual(3, stages['string']['calls'])
+        self.assertEqual(3, stages['string']['out'])
+        self.assertIsNone(stages['string']['memory'])
+
+    def test_serve(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            # the server runs elsewhere, relative paths are the client's
+            root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            path = os.path.join(tmp, 's8e.sock')
+            server = subprocess.Popen(
+                [sys.executable, '-m', 'samplitude', '--serve', '--socket',
+                 path], stderr=subprocess.PIPE, text=True, cwd=tmp,
+                env=dict(os.environ, PYTHONPATH=root))
+            try:
+                for _ in range(100):
+                    if os.path.exists(path):
+                        break
+                    time.sleep(0.1)
+                self.assertTrue(os.path.exists(path))
+                env = dict(os.environ, SAMPLITUDE_SOCKET=path)
+                expr = 'normal(0, 1) | sample(5) | round(3) | cli'
+                self.assertEqual(_run(expr, '3').stdout,
+                                 _run(expr, '3', env=env).stdout)
+                expr = "file('data/galton.csv') | head(2) | cli"
+                self.assertEqual(_run(expr, cwd=root).stdout,
+                                 _run(expr, env=env, cwd=root).stdout)
+                proc = _run('count() | cli', env=env)
+                self.assertEqual(1, proc.returncode)
+                self.assertIn('infinite generator', proc.stderr)
+                proc = _run('normal(0, 1) | sample(10) | hist', env=env)
+                self.assertEqual(1, proc.returncode)
+                self.assertIn('--plot-out', proc.stderr)
+                proc = _run('--workers', '2',
+                            'normal(0, 1) | sample(10) | list', env=env)
+                self.assertEqual(1, proc.returncode)
+                self.assertIn('workers', proc.stderr)
+            finally:
+                server.send_signal(signal.SIGINT)
+                server.wait(timeout=10)
+            self.assertIn('listening on', server.stderr.read())
+            server.stderr.close()
+            self.assertFalse(os.path.exists(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,10 @@
+import io
+import json
+import os
+import tempfile
 import unittest
+import numpy as np
+import samplitude
 from tests import SamplitudeTestCase
 
 
@@ -20,6 +26,190 @@ class TestSamplitudeConsumers(SamplitudeTestCase):
         base = 'range(1, 101) | scale(range(100,0,-1))'
         self.asserts8e('%s | gobble' % base, "[]")
 
+    def test_streaming_output(self):
+        for tmpl in ('count() | sample(10000) | cli',
+                     'uniform(0, 1) | sample(10000) | json',
+                     'range(1000) | json',
+                     'range(1, 7) | choice | sample(100) | counter | cli'):
+            expected = samplitude.samplitude(tmpl, seed=self.seed)
+            out = io.StringIO()
+            self.assertIsNone(samplitude.samplitude(tmpl, seed=self.seed,
+                                                    out=out))
+            self.assertEqual(expected + '\n', out.getvalue())
+
+    def test_streaming_output_engine(self):
+        tmpl = 'uniform(0, 1) | sample(1000) | json'
+        expected = samplitude.samplitude(tmpl, seed=self.seed, engine='numpy')
+        out = io.StringIO()
+        samplitude.samplitude(tmpl, seed=self.seed, engine='numpy',
+                              chunksize=7, out=out)
+        self.assertEqual(expected + '\n', out.getvalue())
+
+    def test_binary_output(self):
+        tmpl = 'uniform(0, 1) | sample(1000)'
+        for engine in ('python', 'numpy'):
+            expected = eval(samplitude.samplitude(tmpl + ' | list',
+                                                  seed=self.seed,
+                                                  engine=engine))
+            with tempfile.TemporaryDirectory() as tmp:
+                npy = os.path.join(tmp, 'x.npy')
+                raw = os.path.join(tmp, 'x.raw')
+                mm = os.path.join(tmp, 'm.npy')
+                for out in ("npy('%s')" % npy, "raw('%s')" % raw,
+                            "memmap('%s')" % mm):
+                    self.assertIsNone(samplitude.samplitude(
+                        '%s | %s' % (tmpl, out), seed=self.seed,
+                        engine=engine, chunksize=7))
+                self.assertEqual(expected,
+                                 np.load(npy, mmap_mode='r').tolist())
+                self.assertEqual(expected, np.fromfile(raw).tolist())
+                self.assertEqual(expected, np.load(mm).tolist())
+
+    def test_binary_output_dtype(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'x.npy')
+            samplitude.samplitude("range(10) | npy('%s', 'int32')" % path)
+            arr = np.load(path)
+            self.assertEqual('int32', arr.dtype.name)
+            self.assertEqual(list(range(10)), arr.tolist())
+            with self.assertRaises(ValueError):
+                samplitude.samplitude("range(3) | memmap('%s', 5)" % path)
+
+    def test_memmap_after_drop(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'x.npy')
+            samplitude.samplitude(
+                "count() | sample(10) | drop(3) | memmap('%s')" % path)
+            self.assertEqual(list(range(3, 10)), np.load(path).tolist())
+
+    def test_stats(self):
+        self.asserts8e('range(1, 101) | stats | json',
+                       '{"n": 100, "mean": 50.5, "var": 833.25, '
+                       '"std": 28.86607004772212, "min": 1, "max": 100}')
+        self.asserts8e('range(1, 101) | mean', '50.5')
+        self.asserts8e('range(1, 101) | var(1)', '841.6666666666666')
+        self.asserts8e('range(1, 101) | quantiles(0.5, 0.99) | cli',
+                       '0.5 50\n0.99 99')
+        tmpl = 'normal(3, 2) | sample(100000) | %s'
+        for engine in ('python', 'numpy'):
+            vals = np.array(eval(samplitude.samplitude(
+                tmpl % 'list', seed=self.seed, engine=engine)))
+            stats = json.loads(samplitude.samplitude(
+                tmpl % 'stats | json', seed=self.seed, engine=engine,
+                chunksize=1000))
+            self.assertAlmostEqual(vals.mean(), stats['mean'])
+            self.assertAlmostEqual(vals.var(), stats['var'])
+            self.assertEqual(vals.min(), stats['min'])
+            quantiles = eval(samplitude.samplitude(
+                tmpl % 'quantiles(0.01, 0.5, 0.99)', seed=self.seed,
+                engine=engine))
+            for q, x in quantiles.items():
+                self.assertAlmostEqual(q, (vals <= x).mean(), delta=0.01)
+
+    def test_stats_merge(self):
+        from samplitude._stats import _KLL, _Moments
+        vals = np.random.default_rng(self.seed).exponential(size=10000)
+        moments, sketch = _Moments(), _KLL()
+        for part in np.array_split(vals, 7):
+            m, s = _Moments(), _KLL()
+            m.update(part.tolist())
+            s.update(part.tolist())
+            moments.merge(m)
+            sketch.merge(s)
+        self.assertEqual(len(vals), moments.n)
+        self.assertAlmostEqual(vals.mean(), moments.mean)
+        self.assertAlmostEqual(vals.var(ddof=1), moments.var(1))
+        self.assertEqual(len(vals), sketch.n)
+        self.assertLess(sum(map(len, sketch.levels)), 1000)
+        for q, x in zip((0.1, 0.9), sketch.quantiles((0.1, 0.9))):
+            self.assertAlmostEqual(q, (vals <= x).mean(), delta=0.01)
+
+    def test_streaming_plots(self):
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+        plt.close('all')
+        self.assertIsNone(samplitude.samplitude(
+            'normal(0, 1) | sample(100000) | hist(50)', seed=self.seed,
+            engine='numpy', chunksize=999))
+        self.assertEqual(100000, sum(p.get_height()
+                                     for p in plt.gca().patches))
+        self.assertEqual(50, len(plt.gca().patches))
+        plt.close('all')
+        self.asserts8e('[3, 1, 2] | line | list', '[3, 1, 2]')
+        self.assertEqual([3, 1, 2], plt.gca().lines[0].get_ydata().tolist())
+        plt.close('all')
+        samplitude.samplitude('count() | sample(10**6) | line')
+        x, y = plt.gca().lines[0].get_data()
+        self.assertLessEqual(len(y), 8000)
+        self.assertEqual((0, 999999), (y.min(), y.max()))
+        plt.close('all')
+        samplitude.samplitude('count() | sample(100) | pairs | scatter(20)',
+                              seed=self.seed)
+        self.assertEqual(20, len(plt.gca().collections[0].get_offsets()))
+        plt.close('all')
+
+    def test_plot_result(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'plot.png')
+            for plot, vals in (('hist', 'count()'), ('line', 'count()'),
+                               ('scatter', 'count() | pairs'),
+                               ('heat', 'count() | pairs')):
+                tmpl = '%s | sample(6) | %%s%s(path=%r)' % (vals, plot, path)
+                # a stream is not kept, so nothing is passed on
+                self.assertIsNone(samplitude.samplitude(tmpl % ''))
+                self.asserts8e(tmpl % '' + ' | cli', '')
+                # whereas a list is
+                self.assertEqual(
+                    samplitude.samplitude(vals + ' | head(6) | list'),
+                    samplitude.samplitude(tmpl % 'list | '))
+
+    def test_streaming_bins(self):
+        from samplitude._binning import _Decimator, _Histogram
+        rng = np.random.default_rng(self.seed)
+        vals = rng.exponential(size=100001) - 1
+        hist, line = _Histogram(25), _Decimator(100)
+        for part in np.array_split(vals, 17):
+            hist.add(part)
+            line.add(part)
+        edges = hist.bin_edges()
+        self.assertLessEqual(edges[0], vals.min())
+        self.assertGreater(edges[-1], vals.max())
+        self.assertEqual(np.histogram(vals, edges)[0].tolist(),
+                         hist.counts.tolist())
+        x, y = line.line()
+        self.assertEqual(np.repeat(np.arange(0, 100001, 512), 2).tolist(),
+                         x.tolist())
+        buckets = [vals[i:i + 512] for i in range(0, len(vals), 512)]
+        self.assertEqual([v for b in buckets for v in (b.min(), b.max())],
+                         y.tolist())
+
+    def test_topk_distinct(self):
+        from collections import Counter  # for eval
+        self.asserts8e('range(1, 7) | choice | sample(10000) | topk(3) | cli',
+                       '3 1719\n1 1681\n4 1671')
+        self.asserts8e("'abcab' | distinct", '3')
+        tmpl = 'normal(0, 30) | sample(100000) | round(0) | %s'
+        for engine in ('python', 'numpy'):
+            counter = eval(samplitude.samplitude(tmpl % 'counter', seed=1,
+                                                 engine=engine, chunksize=999))
+            top = eval(samplitude.samplitude(tmpl % 'topk(3, 50)', seed=1,
+                                             engine=engine, chunksize=999))
+            # heavy hitters with few counters, but counts are underestimates
+            n = sum(counter.values())
+            for x, c in top.items():
+                self.assertLessEqual(c, counter[x])
+                self.assertGreaterEqual(c, counter[x] - n / 51)
+            self.assertEqual(dict(counter.most_common(3)),
+                             eval(samplitude.samplitude(
+                                 tmpl % 'topk(3)', seed=1, engine=engine)))
+            distinct = int(samplitude.samplitude(tmpl % 'distinct', seed=1,
+                                                 engine=engine))
+            self.assertAlmostEqual(len(counter), distinct, delta=2)
+        distinct = int(samplitude.samplitude(
+            'count() | sample(10**6) | scale(0.5) | distinct'))
+        self.assertAlmostEqual(10**6, distinct, delta=25000)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,4 +1,5 @@
 import unittest
+import samplitude
 from tests import SamplitudeTestCase
 
 
@@ -27,6 +28,126 @@ class TestSamplitudeExpressions(SamplitudeTestCase):
     def test_to_json_of_sized_iterator(self):
         self.asserts8e('"ABC"| choice | sample(5) | json', '["C", "A", "B", "C", "B"]')
 
+    def test_template_cache(self):
+        env = samplitude.s8e
+        tmpl = '{{ range(3) | list }}'
+        expression = env.expression(tmpl)
+        self.assertIs(expression, env.expression(' %s ' % tmpl))
+        env.filter('gobble', env.jenv.filters['gobble'])
+        self.assertIsNot(expression, env.expression(tmpl))
+
+    def test_template_cache_seed(self):
+        tmpl = "'HT' | choice | sample(20) | list"
+        self.assertNotEqual(samplitude.samplitude(tmpl, seed=1),
+                            samplitude.samplitude(tmpl, seed=2))
+
+    def test_concurrent_sessions(self):
+        from concurrent.futures import ThreadPoolExecutor
+        tmpls = ["'HT' | choice | sample(50) | counter | json",
+                 'normal(0, 1) | sample(200) | round | list',
+                 'poisson(3) | sample(100) | list']
+        jobs = [(tmpl, seed) for seed in range(20) for tmpl in tmpls]
+        expected = [samplitude.samplitude(tmpl, seed=seed)
+                    for tmpl, seed in jobs]
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            actual = list(pool.map(lambda job: samplitude.samplitude(*job),
+                                   jobs))
+        self.assertEqual(expected, actual)
+
+    def test_template_cache_filters(self):
+        double = {'twice': lambda gen: (2 * x for x in gen)}
+        triple = {'twice': lambda gen: (3 * x for x in gen)}
+        samplitude.samplitude('range(3) | list', filters=double)
+        self.asserts8e('range(3) | twice | list', '[0, 2, 4]')
+        samplitude.samplitude('range(3) | list', filters=triple)
+        self.asserts8e('range(3) | twice | list', '[0, 3, 6]')
+
+    def test_profile_modes(self):
+        import contextlib
+        import io
+        import json
+        env = samplitude.s8e
+        try:
+            for native in (True, False):
+                env.native = native
+                err = io.StringIO()
+                with contextlib.redirect_stderr(err):
+                    self.assertEqual('[0, 1, 2, 3, 4, 5, 6, 7, 8, 9]',
+                                     samplitude.samplitude('range(10) | list',
+                                                           profile='json'))
+                stages = {s['stage']: s for s in json.loads(err.getvalue())}
+                self.assertEqual(1, stages['range']['calls'])
+                self.assertEqual(10, stages['range']['out'])
+                self.assertEqual(10, stages['list']['in'])
+        finally:
+            env.native = True
+
+    def test_native_compiler(self):
+        from samplitude._pipes import _Pipeline, _Unsupported, _compile
+        env = samplitude.s8e
+        tmpls = ['range(10) | sum', '2 * range(4) | sum', '-2**2', '2**3**2',
+                 "['B', 'a', 'C'] | max", "['B', 'a', 'C'] | min(true)",
+                 '[] | max', 'range(5) | sum(start=10) / 4',
+                 'normal(100, 5) | sample(5) | round(2) | list',
+                 "{'H': 3, 'T': 1} | wchoice | sample(9) | list",
+                 'range(10) | shift(2) | scale(0.5) | list',
+                 "range(3) | map('string') | join", '(10**3) | string',
+                 'range(3) | zip(count()) | list', '[[1, 2], (3, 4)][1]']
+        try:
+            for native in (True, False):
+                env.native = native
+                results = [samplitude.samplitude(tmpl, seed=self.seed)
+                           for tmpl in tmpls]
+                if native:
+                    expected = results
+            self.assertEqual(expected, results)
+        finally:
+            env.native = True
+        self.assertIsInstance(env.expression('{{ range(3) | sum }}'),
+                              _Pipeline)
+        self.assertNotIsInstance(env.expression('{{ 2 * range(3) | sum }}'),
+                                 _Pipeline)
+        # the same errors as Jinja2, rather than a meaning of their own
+        for tmpl in ('range(5) | sum(5)', '2 + 1j'):
+            with self.assertRaises(_Unsupported):
+                _compile(tmpl, env.globals, env.filters)
+            with self.assertRaises(Exception):
+                samplitude.samplitude(tmpl)
+        self.assertEqual('15', samplitude.samplitude('range(6) | sum(start=0)'))
+
+    def test_infinite_arguments(self):
+        for tmpl in ('count() | list', 'range(3) | zip(count() | list) | list',
+                     'range(3) | product(count()) | len',
+                     "range(3) | zip(count() | list) | map('string') | join"):
+            with self.assertRaises(ValueError):
+                self.asserts8e(tmpl, '')
+        self.asserts8e('range(3) | zip(count() | shift(1)) | list',
+                       '[(0, 1), (1, 2), (2, 3)]')
+        self.asserts8e('range(3) | zip(count() | head(2) | list) | list',
+                       '[(0, 0), (1, 1)]')
+
+    def test_optimizer(self):
+        env = samplitude.s8e
+        tmpls = ['uniform(0, 1) | scale(2) | shift(-1) | round(2) | sample(5)'
+                 ' | list',
+                 'normal(0, 1) | scale(2) | sample(10)',
+                 'range(10) | scale(2.5) | int | shift(1) | list',
+                 'range(100) | shuffle | sort(true) | round | head(3) | list',
+                 "{'b': 1, 'a': 2, 'c': 0} | sort | head(2) | list",
+                 'range(4) | scale(sin(0.5)) | round(2) | list']
+        try:
+            for engine in ('python', 'numpy'):
+                for native in (True, False):
+                    env.native = native
+                    results = [samplitude.samplitude(tmpl, seed=self.seed,
+                                                     engine=engine, chunksize=3)
+                               for tmpl in tmpls]
+                    if native:
+                        expected = results
+                self.assertEqual(expected, results)
+        finally:
+            env.native = True
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,4 +1,5 @@
 import unittest
+import samplitude
 from samplitude import samplitude as s8e
 from tests import SamplitudeTestCase
 
@@ -19,6 +20,135 @@ class TestSamplitudeFilters(SamplitudeTestCase):
         self.assertEqual('\n'.join(map(str, list(range(5, 15)))),
                          s8e('count() | sample(10) | shift(5) | cli'))
 
+    def test_block_filters(self):
+        sample = 'uniform(0, 10) | sample(100)'
+        vals = eval(s8e(sample + ' | list', seed=self.seed, engine='numpy'))
+        tmpl = sample + ' | drop(7) | scale(3) | shift(-2) | round(1) | int | list'
+        self.assertEqual(str([int(round(3 * x - 2, 1)) for x in vals[7:]]),
+                         s8e(tmpl, seed=self.seed, engine='numpy', chunksize=5))
+
+    def test_block_filter_sampled_argument(self):
+        for engine in ('python', 'numpy'):
+            self.assertEqual(
+                s8e('sin(0.1) | sample(3) | scale(2) | list', engine=engine),
+                s8e('uniform(2, 2) | sample(5) | scale(sin(0.1) | sample(3))'
+                    ' | list', engine=engine, chunksize=2))
+            self.assertEqual('3', s8e('uniform(0, 1) | sample(5) |'
+                                      ' scale(normal(0, 1) | sample(3)) | len',
+                                      engine=engine))
+
+    def test_drop_skips(self):
+        self.asserts8e('count() | drop(10**15) | head(2) | list',
+                       '[1000000000000000, 1000000000000001]')
+        self.asserts8e('count(5, 2) | sample(10) | drop(3) | nth(2)', '15')
+        self.asserts8e('range(10) | sample(5) | drop(2) | list', '[2, 3, 4]')
+        for engine in ('python', 'numpy'):
+            for dist in ('uniform(0, 1)', 'triangular(0, 2)', 'normal(0, 1)'):
+                self.assertEqual(
+                    s8e(dist + ' | sample(30) | list | drop(25) | list',
+                        seed=self.seed, engine=engine),
+                    s8e(dist + ' | drop(23) | head(7) | drop(2) | list',
+                        seed=self.seed, engine=engine, chunksize=4))
+
+    def test_drop_length(self):
+        self.asserts8e('count() | head(10) | drop(3) | len', '7')
+        self.asserts8e('count() | head(10) | drop(30) | len', '0')
+        for engine in ('python', 'numpy'):
+            self.assertEqual('7', s8e('uniform(0, 1) | sample(10) | drop(3) |'
+                                      ' len', engine=engine, chunksize=4))
+
+    def test_float_count(self):
+        self.asserts8e('count() | sample(1e1) | list', str(list(range(10))))
+        self.asserts8e('normal(0, 1) | sample(1e1) | len', '10')
+        self.asserts8e('count() | head(4.0) | drop(1) | list', '[1, 2, 3]')
+        with self.assertRaises(ValueError):
+            s8e('count() | sample(2.5) | list')
+
+    def test_reservoir(self):
+        self.asserts8e('range(10**6) | reservoir(5)',
+                       '[89317, 748882, 613248, 725914, 208056]')
+        self.asserts8e('range(3) | reservoir(5)', '[0, 1, 2]')
+        counts = [0] * 10
+        for seed in range(2000):
+            for x in eval(s8e('range(10) | reservoir(3)', seed=seed)):
+                counts[x] += 1
+        for count in counts:
+            self.assertAlmostEqual(600, count, delta=100)
+
+    def test_weighted_choice(self):
+        self.asserts8e("'ABC' | choice(weights=[1, 0, 3]) | sample(10) | list",
+                       "['C', 'C', 'A', 'C', 'C', 'C', 'C', 'C', 'C', 'C']")
+        self.asserts8e("'ABC' | wchoice([1, 0, 3]) | sample(10) | list",
+                       "['C', 'C', 'A', 'C', 'C', 'C', 'C', 'C', 'C', 'C']")
+        for engine in ('python', 'numpy'):
+            counts = eval(s8e("{'x': 1, 'y': 0, 'z': 4} | wchoice |"
+                              " sample(10000) | counter | json",
+                              seed=self.seed, engine=engine, chunksize=999))
+            self.assertEqual(['x', 'z'], sorted(counts))
+            self.assertAlmostEqual(2000, counts['x'], delta=200)
+        for engine in ('python', 'numpy'):
+            pairs = eval(s8e("[(1, 2), (3, 4)] | wchoice([1, 3]) | sample(5) |"
+                             " list", seed=self.seed, engine=engine))
+            self.assertLessEqual(set(pairs), {(1, 2), (3, 4)})
+            self.assertTrue(all(isinstance(p, tuple) for p in pairs))
+        with self.assertRaises(ValueError):
+            s8e("'AB' | wchoice([1]) | sample(2) | list")
+        with self.assertRaises(ValueError):
+            s8e("'AB' | wchoice([1, -1]) | sample(2) | list")
+
+    def test_lazy_combinatorics(self):
+        import itertools
+        from samplitude._combinatorics import (_Combinations, _Permutations,
+                                               _Product)
+        for lazy, eager in (
+                (_Product(['ab', range(3), 'xyz']),
+                 itertools.product('ab', range(3), 'xyz')),
+                (_Permutations('abcde'), itertools.permutations('abcde')),
+                (_Permutations(range(6), 3), itertools.permutations(range(6), 3)),
+                (_Combinations(range(7), 3), itertools.combinations(range(7), 3)),
+                (_Combinations('abc', 0), itertools.combinations('abc', 0))):
+            eager = list(eager)
+            self.assertEqual(len(eager), len(lazy))
+            self.assertEqual(eager, list(lazy))
+            self.assertEqual(eager, [lazy[i] for i in range(len(lazy))])
+            if eager:
+                self.assertEqual(eager[-1], lazy[-1])
+        self.asserts8e("range(3) | product(range(2), 'add') | list",
+                       '[0, 1, 1, 2, 2, 3]')
+        self.asserts8e("'ab' | product('cd', 'ef', combiner='concat') | list",
+                       "['ace', 'acf', 'ade', 'adf', 'bce', 'bcf', 'bde', 'bdf']")
+        self.asserts8e('[1, 2] | product([3, 4])',
+                       '((1, 3), (1, 4), (2, 3), (2, 4))')
+        self.asserts8e('range(10**6) | product(range(10**6), range(10**6)) | len',
+                       '1000000000000000000')
+        self.asserts8e('range(30) | permutations | choice | sample(2) | len',
+                       '2')
+        self.asserts8e('range(60) | combinations(6) | nth(12345678)',
+                       '(2, 13, 23, 47, 49, 54)')
+        self.asserts8e("'abcde' | nth(3)", 'd')
+
+    def test_fft(self):
+        import numpy as np
+        fft = samplitude.s8e.jenv.filters['fft']
+        t = np.arange(1000)
+        signal = np.sin(0.1 * t) + np.cos(2 * np.pi * 32 / 256 * t)
+        np.testing.assert_allclose(np.fft.fft(signal)[:500],
+                                   fft(signal.tolist()), atol=1e-9)
+        psd = fft(iter(signal.tolist()), 256, overlap=64)
+        self.assertEqual(129, len(psd))
+        self.assertEqual(32, int(np.argmax(psd)))
+        stft = fft(range(1000), 100, overlap=0, mode='stft')
+        self.assertEqual((10, 51), np.shape(stft))
+        np.testing.assert_allclose(
+            np.fft.rfft(np.arange(900, 1000) * np.hanning(101)[:-1]), stft[-1])
+        for engine in ('python', 'numpy'):
+            self.assertEqual('129', s8e('sin(0.1) | sample(5000) | fft(256) '
+                                        '| len', engine=engine, chunksize=1000))
+        spectrum = eval(s8e('sin(0.1) | sample(10000) | fft'))
+        self.assertEqual(5000, len(spectrum))
+        self.assertEqual(5000, len(s8e('sin(0.1) | sample(10000) | fft | cli')
+                                   .splitlines()))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,4 +1,7 @@
+import os
+import tempfile
 import unittest
+from unittest import mock
 from samplitude import samplitude as s8e
 from tests import SamplitudeTestCase
 
@@ -35,10 +38,134 @@ class TestSamplitudeGenerators(SamplitudeTestCase):
         self.asserts8e('chi2(5) | sample(3) | round | len',
                        '3')
 
+    def test_numpy_engine(self):
+        tmpl = 'normal(100, 5) | sample(5) | round | list'
+        expected = s8e(tmpl, seed=self.seed, engine='numpy')
+        self.assertEqual(expected, s8e(tmpl, seed=self.seed, engine='numpy'))
+        self.assertEqual(expected,
+                         s8e(tmpl, seed=self.seed, engine='numpy', chunksize=2))
+        self.assertNotEqual(expected, s8e(tmpl, seed=self.seed))
+
+    def test_numpy_engine_float_count(self):
+        self.assertEqual(
+            s8e('normal(0, 1) | sample(10) | list', seed=self.seed,
+                engine='numpy'),
+            s8e('normal(0, 1) | sample(1e1) | list', seed=self.seed,
+                engine='numpy', chunksize=3))
+
+    def test_numpy_engine_len(self):
+        for dist in ('exponential(2)', 'uniform(0, 1)', 'gauss(0, 1)',
+                     'lognormal(0, 1)', 'triangular(0, 2)', 'beta(2, 3)',
+                     'gamma(2, 3)', 'pareto(2)', 'vonmises(0, 1)',
+                     'weibull(1, 2)', 'poisson(3)'):
+            self.assertEqual('1000', s8e('%s | sample(1000) | list | length' %
+                                         dist, engine='numpy', chunksize=64))
+
+    def test_workers(self):
+        tmpl = 'normal(170, 10) | sample(101) | round | list'
+        for engine in ('python', 'numpy'):
+            two = s8e(tmpl, seed=self.seed, workers=2, engine=engine)
+            self.assertEqual(two, s8e(tmpl, seed=self.seed, workers=2,
+                                      engine=engine))
+            self.assertEqual(101, len(eval(two)))
+            self.assertNotEqual(two, s8e(tmpl, seed=self.seed, workers=3,
+                                         engine=engine))
+
+    def test_workers_filters(self):
+        import multiprocessing
+        twice = lambda gen: (2 * x for x in gen)
+        twice.elementwise = True  # else sampled serially
+        filters = {'twice': twice}
+        tmpl = 'normal(0, 1) | %ssample(11) | list'
+        if multiprocessing.get_start_method() != 'fork':
+            with self.assertRaises(ValueError):
+                s8e(tmpl % 'twice | ', workers=2, filters=filters)
+            return
+        self.assertEqual(
+            [2 * x for x in eval(s8e(tmpl % '', seed=self.seed, workers=2))],
+            eval(s8e(tmpl % 'twice | ', seed=self.seed, workers=2,
+                     filters=filters)))
+
+    def test_workers_require_random_sample(self):
+        with self.assertRaises(ValueError):
+            s8e('range(10) | sample(5) | list', workers=2)
+        with self.assertRaises(ValueError):
+            s8e('count() | shift(1) | sample(5) | list', workers=2)
+
+    def test_workers_position_dependent(self):
+        for stage in ('shift(count())', 'scale(count(1))', 'zip(count())'):
+            tmpl = 'normal(0, 0.0001) | %s | sample(6) | list' % stage
+            self.assertEqual(s8e(tmpl, seed=self.seed),
+                             s8e(tmpl, seed=self.seed, workers=2))
+
     def test_range_head(self):
         self.asserts8e('range(10) | head | list',
                        '[0, 1, 2, 3, 4]')
 
+    def test_waves(self):
+        self.asserts8e('sin(0.1, 2, 1) | head(3) | round | list',
+                       '[1.683, 1.782, 1.864]')
+        self.asserts8e('cos(0.5) | nth(10**15)',
+                       '-0.49335902860545167')
+        for engine in ('python', 'numpy'):
+            self.assertEqual(
+                s8e('tan(0.3) | drop(10**12) | head(3) | round(2) | list',
+                    engine=engine, chunksize=3),
+                s8e('tan(0.3, 1, 0.3 * 10**12) | head(3) | round(2) | list'))
+
+    def test_waves_numpy(self):
+        tmpl = 'sin(0.01) | scale(cos(0.02)) | shift(sin(0.3)) | %s'
+        self.assertEqual(
+            s8e(tmpl % 'sample(100) | round(6) | list', engine='numpy',
+                chunksize=7),
+            s8e(tmpl % 'sample(100) | round(6) | list'))
+
+    def test_csv(self):
+        from samplitude._io import _csv_chunks, _csv_lists
+        fname = 'data/galton.csv'
+        self.assertEqual([1, 1, 1], next(_csv_lists(fname, chunksize=3)))
+        for col in ('height', 'sex', -1, 2):
+            chunks = list(_csv_lists(fname, col, chunksize=100))
+            self.assertEqual(9, len(chunks))
+            self.assertEqual([x for c in _csv_chunks(fname, col, chunksize=7)
+                              for x in c.tolist()],
+                             [x for c in chunks for x in c])
+        self.asserts8e("csv('data/galton.csv', 'sex') | sample(3) | list",
+                       "['M', 'F', 'F']")
+        tmpl = "csv('data/galton.csv', 'height') | sum"
+        for engine in ('python', 'numpy'):
+            self.assertAlmostEqual(59951.1, float(s8e(tmpl, engine=engine,
+                                                      chunksize=100)))
+
+    def test_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            fname = os.path.join(tmp, 'lines.txt')
+            with open(fname, 'w', newline='') as f:
+                f.write('a b\n\nc\r\nd')
+            for mmap in ('False', 'True'):
+                self.asserts8e("file('%s', mmap=%s) | list" % (fname, mmap),
+                               "['a b', '', 'c', 'd']")
+            open(fname, 'w').close()
+            self.asserts8e("file('%s', mmap=True) | list" % fname, '[]')
+
+    def test_file_index(self):
+        from samplitude._lines import _index_path
+        with tempfile.TemporaryDirectory() as tmp, \
+                mock.patch.dict(os.environ, {'SAMPLITUDE_CACHE': tmp}):
+            fname = os.path.join(tmp, 'lines.txt')
+            with open(fname, 'w') as f:
+                f.write(''.join('line %d\n' % i for i in range(1000)))
+            tmpl = "file('%s') | %schoice | sample(4) | list"
+            expected = s8e(tmpl % (fname, 'list | '), seed=self.seed)
+            self.assertEqual(expected, s8e(tmpl % (fname, ''), seed=self.seed))
+            self.assertTrue(os.path.isfile(_index_path(fname)))
+            self.asserts8e("file('%s') | len" % fname, '1000')
+            with open(fname, 'a') as f:
+                f.write('last')
+            self.asserts8e("file('%s') | len" % fname, '1001')
+            self.asserts8e("file('%s', mmap=True) | drop(999) | list" % fname,
+                           "['line 999', 'last']")
+
 
 if __name__ == '__main__':
     unittest.main()